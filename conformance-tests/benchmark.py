@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+
+import json
+import os
+import sys
+import time
+
+from runTest import *
+
+# Usage: python benchmark.py <name> pfa-tests.json [options...]
+#
+# Each benchmark times a piece of the conformance machinery on a real corpus
+# and prints a small table; nothing here is needed to run the tests.
+
+def lineMatchingExamples(openFile):
+    # the reader getExamples used before CorpusScanner: only works on the
+    # exact layout of the released pfa-tests.json
+    inFunction = False
+    collectedString = []
+    for line in openFile:
+        if line.startswith("""     {"function":"""):
+            inFunction = True
+        elif line == """     },\n""" or line == """     }\n""":
+            inFunction = False
+            collectedString.append("}")
+            yield json.loads("".join(collectedString))
+            collectedString = []
+        if inFunction:
+            collectedString.append(line)
+
+def scannedExamples(openFile):
+    for entry in CorpusScanner(openFile).entries():
+        yield entry.example
+
+def timeReader(label, reader, inputFile):
+    size = os.path.getsize(inputFile)
+    numExamples = 0
+    numTrials = 0
+    start = time.time()
+    for example in reader(open(inputFile)):
+        numExamples += 1
+        numTrials += len(example["trials"])
+    seconds = time.time() - start
+    print("%-24s %8.2f s %8.1f MB/s %9.0f examples/s %10.0f trials/s" % (label, seconds, size / seconds / 1e6, numExamples / seconds, numTrials / seconds))
+    return numExamples
+
+def benchmarkParse(inputFile):
+    print("%d bytes" % os.path.getsize(inputFile))
+    old = timeReader("line-matching reader", lineMatchingExamples, inputFile)
+    new = timeReader("CorpusScanner", scannedExamples, inputFile)
+    if old != new:
+        print("readers disagree: %d vs %d examples" % (old, new))
+
+def scanAssigned(inputFile, entries):
+    # what a worker does without a shared map: read and decode the whole
+    # corpus, keeping only its own examples
+    wanted = set(x.number for x in entries)
+    openFile = open(inputFile, "rb")
+    for entry in CorpusScanner(openFile).entries():
+        if entry.number in wanted and entry.error is None:
+            convertInput(entry.example)
+    return openFile.tell()
+
+def scanWorker(corpusMap, entries):
+    corpusMap.bytesRead = scanAssigned(corpusMap.inputFile, entries)
+
+def mappedWorker(corpusMap, entries):
+    for number, example in getMappedExamples(corpusMap, entries):
+        pass
+
+def benchmarkMmap(inputFile, numWorkers="4"):
+    numWorkers = int(numWorkers)
+    assignments = partitionEntries(requireIndex(inputFile, "the memory map benchmark")[1], numWorkers)
+    corpusMap = CorpusMap(inputFile)
+    for label, work in ("each worker scans the file", scanWorker), ("shared memory map", mappedWorker):
+        start = time.time()
+        results = runMapped(corpusMap, assignments, work)
+        seconds = time.time() - start
+        print("%s (%d workers): %.2f s" % (label, numWorkers, seconds))
+        for result, stats in results:
+            print("    pid %-8d %6d examples %12d bytes read   peak RSS %8.1f MB" % (stats["pid"], stats["examples"], stats["bytesRead"], stats["maxRSS"] / 1024.0))
+        print("    total %27d bytes read   peak RSS %8.1f MB" % (sum(stats["bytesRead"] for result, stats in results), sum(stats["maxRSS"] for result, stats in results) / 1024.0))
+    corpusMap.close()
+
+def timeLoad(label, inputFile, binary=False):
+    numExamples = 0
+    numTrials = 0
+    start = time.time()
+    for number, example in getNumberedExamples(inputFile, binary=binary):
+        numExamples += 1
+        numTrials += len(example["trials"])
+    seconds = time.time() - start
+    print("%-24s %12d bytes %8.2f s %9.0f examples/s %10.0f trials/s" % (label, os.path.getsize(inputFile), seconds, numExamples / seconds, numTrials / seconds))
+
+def benchmarkBinary(inputFile, binaryFile):
+    # loading includes convertInput for the JSON corpus, since the binary one
+    # stores its result
+    timeLoad("JSON + convertInput", inputFile)
+    timeLoad("binary", binaryFile, True)
+
+def benchmarkCompressed(*inputFiles):
+    # full decompress-and-scan throughput of each file, then the time to reach
+    # the function in the middle of the corpus through the index
+    for inputFile in inputFiles:
+        start = time.time()
+        numBytes = 0
+        for entry in CorpusScanner(openCorpus(inputFile)).entries():
+            numBytes = entry.offset + entry.length
+        seconds = time.time() - start
+        print("%-32s %12d bytes on disk %8.2f s %8.1f MB/s decompressed" % (inputFile, os.path.getsize(inputFile), seconds, numBytes / seconds / 1e6))
+
+        index = loadIndex(inputFile)
+        if index is not None:
+            header, entries = index
+            function = entries[len(entries) // 2].function
+            start = time.time()
+            numExamples = len(list(getNumberedExamples(inputFile, [function])))
+            print("%-32s %d examples of %s through the index in %.3f s%s" % ("", numExamples, function, time.time() - start, "" if "chunks" in header else " (no chunk table)"))
+
+def benchmarkDecode(inputFile, numWorkers="4", readAhead="64"):
+    # examples/s through getNumberedExamples, serially and with a decode pool
+    requireIndex(inputFile, "the decode pool")
+    for label, workers in ("serial", 0), ("%s decode workers" % numWorkers, int(numWorkers)):
+        numExamples = 0
+        start = time.time()
+        for number, example in getNumberedExamples(inputFile, None, workers, int(readAhead)):
+            numExamples += 1
+        seconds = time.time() - start
+        print("%-24s %8.2f s %9.0f examples/s" % (label, seconds, numExamples / seconds))
+
+def isNested(t):
+    return isinstance(t, list) or (isinstance(t, dict) and t["type"] in ("array", "map", "record"))
+
+def benchmarkConvert(inputFile):
+    # trial inputs/s through convertIn and through compiled converters
+    # (including compiling them), over every example whose input type is a
+    # record, array, map or union
+    samples = []
+    for entry in CorpusScanner(openCorpus(inputFile)).entries():
+        if entry.error is None and isNested(entry.example["engine"]["input"]):
+            samples.append((entry.example["engine"]["input"], [x["sample"] for x in entry.example["trials"]]))
+    numValues = sum(len(values) for t, values in samples)
+    print("%d trial inputs of %d examples" % (numValues, len(samples)))
+
+    def recursive():
+        for t, values in samples:
+            for x in values:
+                convertIn(x, t)
+
+    def compiled():
+        inputConverters.clear()
+        for t, values in samples:
+            convert = compileInputConverter(t)
+            for x in values:
+                convert(x)
+
+    for label, run in ("convertIn", recursive), ("compileInputConverter", compiled):
+        start = time.time()
+        run()
+        seconds = time.time() - start
+        print("%-24s %8.2f s %10.0f values/s" % (label, seconds, numValues / seconds))
+
+def benchmarkValidate(inputFile, pattern="model.tree.*"):
+    # trial inputs/s through getNamesFromFunctions and checkInputType, and
+    # through compiled validators (including compiling them), on the
+    # (converted) examples whose function matches pattern
+    predicate = selectionPredicate([pattern])
+    examples = []
+    for entry in CorpusScanner(openCorpus(inputFile)).entries():
+        if entry.error is None and predicate(entry.number, entry.example["function"]):
+            examples.append(convertInput(entry.example))
+    numValues = sum(len(x["trials"]) for x in examples)
+    print("%d trial inputs of %d %s examples" % (numValues, len(examples), pattern))
+
+    def recursive():
+        for example in examples:
+            inputType = example["engine"]["input"]
+            typeNames = getNamesFromFunctions([x for x in example["engine"]["action"][example["function"]] if isinstance(x, dict) and "params" in x])
+            typeNames.update(getNamesFromType(inputType))
+            for trial in example["trials"]:
+                checkInputType(trial["sample"], inputType, typeNames)
+
+    def compiled():
+        inputValidators.clear()
+        for example in examples:
+            validate = exampleValidator(example)
+            for trial in example["trials"]:
+                validate(trial["sample"])
+
+    for label, run in ("checkInputType", recursive), ("compileInputValidator", compiled):
+        start = time.time()
+        run()
+        seconds = time.time() - start
+        print("%-24s %8.2f s %10.0f values/s" % (label, seconds, numValues / seconds))
+
+def benchmarkColumns(inputFile, *patterns):
+    # microseconds per trial to convert the examples of each namespace row by
+    # row (convertInput) and into columns (sampleColumns)
+    patterns = patterns or ("m", "prob.dist", "metric")
+    predicates = [(pattern, selectionPredicate([pattern])) for pattern in patterns]
+    examples = dict((pattern, []) for pattern in patterns)
+    for entry in CorpusScanner(openCorpus(inputFile)).entries():
+        if entry.error is None:
+            for pattern, predicate in predicates:
+                if predicate(entry.number, entry.example["function"]):
+                    examples[pattern].append(entry.example)
+
+    for pattern in patterns:
+        numTrials = sum(len(x["trials"]) for x in examples[pattern])
+        print("%s: %d trials of %d examples" % (pattern, numTrials, len(examples[pattern])))
+        for label, convert in ("convertInput", convertInput), ("sampleColumns", sampleColumns):
+            inputConverters.clear()
+            inputValidators.clear()
+            start = time.time()
+            results = [convert(x) for x in examples[pattern]]
+            seconds = time.time() - start
+            fallbacks = " (%d examples not columnar)" % sum(1 for x in results if x is None) if convert is sampleColumns else ""
+            print("    %-20s %8.3f s %8.2f us/trial%s" % (label, seconds, 1e6 * seconds / max(numTrials, 1), fallbacks))
+
+def benchmarkParsed(inputFile):
+    # the full corpus parsed and converted, walking and copying every sample
+    # again with convertIn, then using the samples that are already in their
+    # final form as parsed
+    for label, reuseParsed in ("parse, then convert", False), ("parse to final form", True):
+        inputConverters.clear()
+        inputValidators.clear()
+        numExamples = 0
+        numTrials = 0
+        numReused = 0
+        start = time.time()
+        for entry in CorpusScanner(openCorpus(inputFile)).entries():
+            if entry.error is None:
+                example = convertInput(entry.example, reuseParsed)
+                numExamples += 1
+                numTrials += len(example["trials"])
+                numReused += sum(1 for x, y in zip(example["trials"], entry.example["trials"]) if x is y)
+        seconds = time.time() - start
+        print("%-24s %8.2f s %9.0f examples/s   %d of %d samples used as parsed" % (label, seconds, numExamples / seconds, numReused, numTrials))
+
+# compare as it was before agrees: builds the path to every value it visits
+
+def breadcrumbCompare(one, two, zeroTolerance, fractionalTolerance, infinityTolerance, breadcrumbs=None):
+    if breadcrumbs is None:
+        breadcrumbs = ["top"]
+    if isinstance(one, dict) and isinstance(two, dict):
+        if set(one.keys()) != set(two.keys()):
+            yield "different dict keys: {%s} vs {%s} at %s" % (", ".join(sorted(one.keys())), ", ".join(sorted(two.keys())), " -> ".join(breadcrumbs))
+        else:
+            for k in sorted(one.keys()):
+                for x in breadcrumbCompare(one[k], two[k], zeroTolerance, fractionalTolerance, infinityTolerance, breadcrumbs + [k]):
+                    yield x
+    elif isinstance(one, list) and isinstance(two, list):
+        if len(one) != len(two):
+            yield "different list lengths: %d vs %d at %s" % (len(one), len(two), " -> ".join(breadcrumbs))
+        else:
+            for i in range(len(one)):
+                for x in breadcrumbCompare(one[i], two[i], zeroTolerance, fractionalTolerance, infinityTolerance, breadcrumbs + [str(i)]):
+                    yield x
+    elif isinstance(one, str) and isinstance(two, str):
+        if one != two:
+            yield "different values: %s vs %s at %s" % (json.dumps(one), json.dumps(two), " -> ".join(breadcrumbs))
+    elif isinstance(one, bool) and isinstance(two, bool):
+        if one != two:
+            yield "different values: %r vs %r at %s" % (one, two, " -> ".join(breadcrumbs))
+    elif isinstance(one, int) and isinstance(two, int):
+        if one != two:
+            yield "different values: %d vs %d at %s" % (one, two, " -> ".join(breadcrumbs))
+    elif one == "inf" and isinstance(two, (int, float)) and two > infinityTolerance:
+        pass
+    elif one == "-inf" and isinstance(two, (int, float)) and two < -infinityTolerance:
+        pass
+    elif two == "inf" and isinstance(one, (int, float)) and one > infinityTolerance:
+        pass
+    elif two == "-inf" and isinstance(one, (int, float)) and one < -infinityTolerance:
+        pass
+    elif (one == "inf" or one == "-inf" or one == "nan") and isinstance(two, (int, float)):
+        yield "different values: %s vs %g at %s" % (one, two, " -> ".join(breadcrumbs))
+    elif (two == "inf" or two == "-inf" or two == "nan") and isinstance(one, (int, float)):
+        yield "different values: %g vs %s at %s" % (one, two, " -> ".join(breadcrumbs))
+    elif isinstance(one, (int, float)) and isinstance(two, (int, float)):
+        if abs(one) < zeroTolerance and abs(two) < zeroTolerance:
+            pass   # they're both about zero
+        elif abs(one) < zeroTolerance:
+            yield "different values beyond tolerance: %g ~ 0 vs %g at %s" % (one, two, " -> ".join(breadcrumbs))
+        elif abs(two) < zeroTolerance:
+            yield "different values beyond tolerance: %g vs %g ~ 0 at %s" % (one, two, " -> ".join(breadcrumbs))
+        elif abs(one - two)/abs(one) > fractionalTolerance:
+            yield "different values beyond tolerance: abs(%g - %g)/%g = %g at %s" % (one, two, abs(one), abs(one - two)/abs(one), " -> ".join(breadcrumbs))
+    elif isinstance(one, bool) and isinstance(two, bool):
+        if one != two:
+            yield "different values: %r vs %r at %s" % (one, two, " -> ".join(breadcrumbs))
+    elif one is None and two is None:
+        pass
+    else:
+        yield "different types: %s vs %s at %s" % (type(one).__name__, type(two).__name__, " -> ".join(breadcrumbs))
+
+def benchmarkCompare(inputFile, *patterns):
+    # microseconds per trial to compare each expected result with an equal
+    # copy of itself (as a passing trial does), for the examples of each
+    # namespace
+    patterns = patterns or ("la", "model")
+    predicates = [(pattern, selectionPredicate([pattern])) for pattern in patterns]
+    results = dict((pattern, []) for pattern in patterns)
+    for entry in CorpusScanner(openCorpus(inputFile)).entries():
+        if entry.error is None:
+            for pattern, predicate in predicates:
+                if predicate(entry.number, entry.example["function"]):
+                    results[pattern].extend((x["result"], json.loads(json.dumps(x["result"]))) for x in entry.example["trials"] if "result" in x)
+
+    for pattern in patterns:
+        print("%s: %d trial results" % (pattern, len(results[pattern])))
+        for label, function in ("breadcrumbCompare", breadcrumbCompare), ("compare", compare):
+            start = time.time()
+            numMessages = sum(len(list(function(one, two, 1e-4, 0.05, 1e80))) for one, two in results[pattern])
+            seconds = time.time() - start
+            print("    %-20s %8.3f s %8.2f us/trial %6d messages" % (label, seconds, 1e6 * seconds / max(len(results[pattern]), 1), numMessages))
+
+def nearlyEqual(x):
+    # x with every double moved by a relative 1e-12, as a different
+    # implementation's rounding would
+    if isinstance(x, float):
+        return x * (1.0 + 1e-12)
+    elif isinstance(x, list):
+        return [nearlyEqual(v) for v in x]
+    elif isinstance(x, dict):
+        return dict((k, nearlyEqual(v)) for k, v in x.items())
+    else:
+        return x
+
+def benchmarkTolerance(inputFile, size="100", *patterns):
+    # microseconds per trial to compare each expected result with a copy
+    # whose doubles differ within tolerance, element by element and with
+    # vectorAgrees, for the examples of each namespace and for a synthetic
+    # size x size matrix
+    import runTest
+    import random
+    patterns = patterns or ("la", "m.link", "a")
+    predicates = [(pattern, selectionPredicate([pattern])) for pattern in patterns]
+    results = dict((pattern, []) for pattern in patterns)
+    for entry in CorpusScanner(openCorpus(inputFile)).entries():
+        if entry.error is None:
+            for pattern, predicate in predicates:
+                if predicate(entry.number, entry.example["function"]):
+                    results[pattern].extend((x["result"], nearlyEqual(x["result"])) for x in entry.example["trials"] if "result" in x)
+    label = "%sx%s matrix" % (size, size)
+    matrix = [[random.gauss(0, 1) for j in range(int(size))] for i in range(int(size))]
+    results[label] = [(matrix, nearlyEqual(matrix))] * 10
+    patterns = patterns + (label,)
+
+    import numpy
+    threshold = runTest.VECTOR_THRESHOLD
+    for pattern in patterns:
+        print("%s: %d trial results" % (pattern, len(results[pattern])))
+        for method, minimum in ("element by element", float("inf")), ("vectorAgrees", threshold):
+            runTest.VECTOR_THRESHOLD = minimum
+            start = time.time()
+            numMessages = sum(len(list(compare(one, two, 1e-4, 0.05, 1e80))) for one, two in results[pattern])
+            seconds = time.time() - start
+            print("    %-20s %8.3f s %10.2f us/trial %6d messages" % (method, seconds, 1e6 * seconds / max(len(results[pattern]), 1), numMessages))
+    runTest.VECTOR_THRESHOLD = threshold
+
+def sortedCompare(left, right, zeroTolerance, fractionalTolerance, infinityTolerance):
+    # how runTestTitus.py compared "unordered" results before compareUnordered
+    def mapToFloat(value):
+        if value in ["inf", "-inf"]:
+            return float(value)
+        elif value == "nan":
+            return float("inf")
+        else:
+            return value
+    try:
+        left.sort()
+        right.sort()
+    except:
+        if isinstance(left[0], dict) and isinstance(right[0], dict):
+            try:
+                left = sorted([sorted([[k, mapToFloat(v)] for k,v in d.items()]) for d in left])
+                right = sorted([sorted([[k, mapToFloat(v)] for k,v in d.items()]) for d in right])
+            except: pass
+    return compare(left, right, zeroTolerance, fractionalTolerance, infinityTolerance)
+
+def benchmarkUnordered(inputFile, size="100000"):
+    # seconds to compare each "unordered" result of the corpus, and lists of
+    # size strings (map.keys), doubles that differ within tolerance, and
+    # single-entry maps (map.split), with a shuffled copy of itself
+    import random
+    try:
+        import numpy   # so that neither method pays for the import
+    except ImportError:
+        pass
+    size = int(size)
+    results = []
+    for entry in CorpusScanner(openCorpus(inputFile)).entries():
+        if entry.error is None:
+            results.extend((x["result"], x["result"]) for x in entry.example["trials"] if x.get("nondeterministic") == "unordered" and "result" in x)
+    strings = ["key%d" % i for i in range(size)]
+    doubles = [random.gauss(0, 1) for i in range(size)]
+    maps = [{"key%d" % i: random.gauss(0, 1)} for i in range(size)]
+    cases = [("%d corpus results" % len(results), results)]
+    cases += [("%d %s" % (size, label), [(values, shuffled)]) for label, values, shuffled in [("strings", strings, strings), ("doubles", doubles, nearlyEqual(doubles)), ("maps", maps, maps)]]
+    for label, pairs in cases:
+        print(label)
+        for method, function in ("sort, then compare", sortedCompare), ("compareUnordered", compareUnordered):
+            pairs = [(list(one), random.sample(two, len(two))) for one, two in pairs]
+            start = time.time()
+            numMessages = sum(len(list(function(one, two, 1e-4, 0.05, 1e80))) for one, two in pairs)
+            print("    %-20s %8.3f s %6d messages" % (method, time.time() - start, numMessages))
+
+def perTrialActions(engine, samples, convert, runtimeError):
+    # how runTestTitus.py ran the trials of an example before runActions, less
+    # the report strings it built for every trial, which runActions does not
+    # build either
+    results = []
+    for sample in samples:
+        try:
+            result = {"success": convert(engine.action(sample))}
+        except runtimeError as err:
+            result = {"fail": err.code}
+        results.append(result)
+    return results
+
+def benchmarkActions(inputFile, *patterns):
+    # trials per second through each engine's action, one trial at a time as
+    # before and in batches of ACTION_BATCH with runActions, for the examples
+    # of each function; Titus has no batch entry point, so runActions uses its
+    # tight loop
+    from titus.genpy import PFAEngine
+    from titus.errors import PFARuntimeException
+    patterns = patterns or ("m.abs", "cast.int", "s.concat", "a.sort")
+    predicate = selectionPredicate(list(patterns))
+    examples = {}
+    for entry in CorpusScanner(openCorpus(inputFile)).entries():
+        if entry.error is None and predicate(entry.number, entry.example["function"]):
+            examples.setdefault(entry.example["function"], []).append(entry.example)
+
+    for function in sorted(examples):
+        cases = []
+        for example in examples[function]:
+            try:
+                engine, = PFAEngine.fromJson(example["engine"])
+            except Exception:
+                continue
+            convert = compileOutputConverter(engine.outputType.jsonNode(set()), dobase64=True)
+            cases.append((engine, [x["sample"] for x in example["trials"]], convert))
+        numTrials = sum(len(samples) for engine, samples, convert in cases)
+        print("%s: %d trials in %d examples" % (function, numTrials, len(cases)))
+
+        def batched(engine, samples, convert, runtimeError):
+            results = []
+            for batch in trialBatches(samples):
+                results.extend(runActions(engine.action, batch, convert, runtimeError, lambda err: err.code, getattr(engine, "actionBatch", None))[0])
+            return results
+
+        for label, method in ("one at a time", perTrialActions), ("runActions", batched):
+            start = time.time()
+            for engine, samples, convert in cases:
+                method(engine, samples, convert, PFARuntimeException)
+            seconds = time.time() - start
+            print("    %-20s %8.3f s %12.0f trials/s" % (label, seconds, numTrials / max(seconds, 1e-9)))
+
+benchmarks = {"parse": benchmarkParse, "mmap": benchmarkMmap, "binary": benchmarkBinary, "compressed": benchmarkCompressed, "decode": benchmarkDecode, "convert": benchmarkConvert, "validate": benchmarkValidate, "columns": benchmarkColumns, "parsed": benchmarkParsed, "compare": benchmarkCompare, "tolerance": benchmarkTolerance, "unordered": benchmarkUnordered, "actions": benchmarkActions}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in benchmarks:
+        sys.stderr.write("usage: %s {%s} pfa-tests.json [options...]\n" % (sys.argv[0], ",".join(sorted(benchmarks))))
+        sys.exit(1)
+    benchmarks[sys.argv[1]](*sys.argv[2:])
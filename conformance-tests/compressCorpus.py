@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+from runTest import compressCorpus
+
+# Usage: python compressCorpus.py pfa-tests.json pfa-tests.json.gz [chunk size in bytes]
+#
+# Compresses a corpus (.gz, .xz, .bz2, or .zst with the zstandard package) in
+# independent chunks that begin at example boundaries, and writes its index.
+# The result decompresses to the original file with the usual tools, and the
+# runners read it directly; with the index, --select only decompresses the
+# chunks holding the selected examples.
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 2:
+        inputFile, outputFile = sys.argv[1:]
+        chunkSize = 1048576
+    else:
+        inputFile, outputFile, chunkSize = sys.argv[1:]
+        chunkSize = int(chunkSize)
+
+    header, entries = compressCorpus(inputFile, outputFile, chunkSize)
+    print("%s: %d examples in %d chunks, %d bytes (%s is %d bytes)" % (outputFile, len(entries), len(header["chunks"]), os.path.getsize(outputFile), inputFile, os.path.getsize(inputFile)))
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+from runTest import writeBinaryCorpus
+
+# Usage: python convertCorpus.py pfa-tests.json pfa-tests.bin
+#
+# Writes the corpus in the binary form read by the runners' --binary (and
+# getExamples with binary=True), with every trial input already converted:
+# real infinities and NaNs instead of "inf"/"-inf"/"nan" strings and decoded
+# bytes instead of base64.  The output is a pickle-based cache, so it is never
+# read unless asked for; only read files you built yourself.
+
+if __name__ == "__main__":
+    inputFile, outputFile = sys.argv[1:]
+    numExamples = writeBinaryCorpus(inputFile, outputFile)
+    print("%s: %d examples, %d bytes (%s is %d bytes)" % (outputFile, numExamples, os.path.getsize(outputFile), inputFile, os.path.getsize(inputFile)))
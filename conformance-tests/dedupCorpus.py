@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+from runTest import dedupCorpus
+
+# Usage: python dedupCorpus.py pfa-tests.json pfa-tests-dedup.json
+#
+# Writes a copy of the corpus in which every engine that several examples
+# share is stored once, in "pfa-engines", and referred to by its hash
+# ("engineRef").  The runners read either form; with the deduplicated one,
+# each shared engine is parsed once and runTestTitus.py compiles it once
+# (every example still gets a fresh instance of it).
+# Prints how much engine parsing and compiling this saves.
+
+if __name__ == "__main__":
+    inputFile, outputFile = sys.argv[1:]
+    stats = dedupCorpus(inputFile, outputFile)
+    print("%s: %d examples, %d bytes (%s is %d bytes)" % (outputFile, stats["examples"], os.path.getsize(outputFile), inputFile, os.path.getsize(inputFile)))
+    print("%d distinct engines, %d of them shared by %d examples" % (stats["distinctEngines"], stats["sharedEngines"], stats["examplesWithSharedEngines"]))
+    print("engine documents parsed and compiled: %d instead of %d (%d fewer)" % (stats["examples"] - stats["enginesNotParsed"], stats["examples"], stats["enginesNotParsed"]))
+    print("engine JSON parsed: %d instead of %d bytes (%d fewer)" % (stats["engineBytes"] - stats["engineBytesNotParsed"], stats["engineBytes"], stats["engineBytesNotParsed"]))
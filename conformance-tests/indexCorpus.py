@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+
+import sys
+
+from runTest import buildIndex, indexFileName
+
+# Usage: python indexCorpus.py pfa-tests.json [pfa-tests.json.idx]
+#
+# Writes the sidecar index that lets getExamples and the runners seek straight
+# to selected examples (--select) instead of reading the whole corpus.
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 1:
+        inputFile, = sys.argv[1:]
+        indexFile = indexFileName(inputFile)
+    else:
+        inputFile, indexFile = sys.argv[1:]
+
+    header, entries = buildIndex(inputFile, indexFile)
+    print("%s: %d examples, %d trials, corpus hash %s" % (indexFile, len(entries), sum(x.trials for x in entries), header["corpusHash"]))
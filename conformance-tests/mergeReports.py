@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+import json
+import re
+import sys
+
+# Usage: python mergeReports.py shards.json report-1.txt report-2.txt ... > report.txt
+#
+# Combines the reports of runTestTitus.py or runTestHadrian.py on the shards
+# written by shardCorpus.py into the report of a single run: each report is
+# cut into per-example blocks (a line starting with the example number and
+# everything up to the next one), and the blocks are written in example
+# order.  Examples that no report covers are listed on stderr.
+
+blockStart = re.compile(r"^\s*([0-9]+)    ")
+
+def reportBlocks(fileName):
+    blocks = {}
+    preamble = []
+    number = None
+    for line in open(fileName):
+        m = blockStart.match(line)
+        if m is not None:
+            number = int(m.group(1))
+            blocks[number] = []
+        if number is None:
+            preamble.append(line)
+        else:
+            blocks[number].append(line)
+    return preamble, blocks
+
+if __name__ == "__main__":
+    manifest = json.load(open(sys.argv[1]))
+    merged = {}
+    for fileName in sys.argv[2:]:
+        preamble, blocks = reportBlocks(fileName)
+        sys.stdout.write("".join(preamble))
+        merged.update(blocks)
+
+    for number in sorted(merged):
+        sys.stdout.write("".join(merged[number]))
+
+    expected = set(number for shard in manifest["shards"] for number in shard["numbers"])
+    missing = sorted(expected.difference(merged))
+    if missing:
+        sys.stderr.write("%d of %d examples are missing from the reports, the first being %s\n" % (len(missing), len(expected), ", ".join(map(str, missing[:10]))))
+        sys.exit(1)
@@ -2,7 +2,18 @@
 
 import json
 import base64
+import bisect
+import codecs
+import fnmatch
+import hashlib
 import math
+import os
+import pickle
+import re
+import shutil
+import struct
+import sys
+from collections import Counter, namedtuple
 
 # NOTE: Due to limitations in JSON, the following substitutions must be made.
 #       (JSON can only store finite numbers and legal Unicode strings.)
@@ -15,6 +26,37 @@ import math
 #   When expecting a "bytes" or "fixed":
 #     content must be base64-decoded
 
+# Engines represent bytes and fixed values as strings with one character per
+# byte (Titus's bytesToString), so that is the form convertIn produces and
+# convertOut expects. On Python 3 the latin-1 codec does that mapping in one
+# call each way instead of a map(chr, ...) or map(ord, ...) per byte, and an
+# engine that returns native bytes, bytearray or memoryview is encoded
+# directly without going through a string at all.
+
+# JSON strings are str on Python 3 and unicode on Python 2 (Jython, for
+# runTestHadrian.py), which the readers check for as stringTypes.
+
+if sys.version_info[0] >= 3:
+    nativeBytes = (bytes, bytearray, memoryview)
+    stringTypes = (str,)
+
+    def convertBytes(x):
+        return base64.b64decode(x).decode("latin-1")
+
+    def encodeBytes(x):
+        if isinstance(x, str):
+            x = x.encode("latin-1")
+        return base64.b64encode(x).decode("ascii")
+else:
+    nativeBytes = ()
+    stringTypes = (str, unicode)
+
+    def convertBytes(x):
+        return ''.join(map(chr, list(base64.b64decode(x))))
+
+    def encodeBytes(x):
+        return ''.join(map(chr, list(base64.b64encode(bytes(map(ord, list(x)))))))
+
 def convertIn(x, t):
     if t == "float" or t == "double":
         if x == "inf":
@@ -27,7 +69,7 @@ def convertIn(x, t):
             return x
 
     elif t == "bytes" or (isinstance(t, dict) and t["type"] == "fixed"):
-        return ''.join(map(chr, list(base64.b64decode(x))))
+        return convertBytes(x)
 
     elif isinstance(t, dict) and t["type"] == "array":
         if not isinstance(x, list): raise Exception
@@ -51,7 +93,7 @@ def convertIn(x, t):
                     name = ti["name"]
                 elif isinstance(ti, dict):
                     name = ti["type"]
-                elif isinstance(ti, str):
+                elif isinstance(ti, stringTypes):
                     name = ti
                 if tag == name:
                     return {tag: convertIn(value, ti)}
@@ -80,17 +122,18 @@ def convertOut(x, t, dobase64=True):
         else:
             return x
 
-    elif isinstance(x, str) and t == "string":
+    elif isinstance(x, stringTypes) and t == "string":
         return x
 
-    elif isinstance(x, str) and (t == "bytes" or (isinstance(t, dict) and t["type"] == "fixed")):
+    elif isinstance(x, stringTypes) and (t == "bytes" or (isinstance(t, dict) and t["type"] == "fixed")):
         if dobase64:
-            x = bytes(map(ord, list(x)))
-            out = base64.b64encode(x)
-            return ''.join(map(chr,list(out)))
+            return encodeBytes(x)
         else:
             return x
 
+    elif isinstance(x, nativeBytes) and dobase64 and (t == "bytes" or (isinstance(t, dict) and t["type"] == "fixed")):
+        return encodeBytes(x)
+
     elif isinstance(x, list) and isinstance(t, dict) and t["type"] == "array":
         return [convertOut(v, t["items"], dobase64) for v in x]
 
@@ -113,7 +156,7 @@ def convertOut(x, t, dobase64=True):
                     name = ti["name"]
                 elif isinstance(ti, dict):
                     name = ti["type"]
-                elif isinstance(ti, str):
+                elif isinstance(ti, stringTypes):
                     name = ti
                 if tag == name:
                     return {tag: convertOut(value, ti, dobase64)}
@@ -139,6 +182,309 @@ def convertOut(x, t, dobase64=True):
     else:
         raise Exception
 
+# Compiled output converters: compileOutputConverter(t, dobase64) returns a
+# function that does what convertOut(x, t, dobase64) does, with the type
+# inspected once.  convertOut picks the branch of a union for an untagged
+# value by converting it with each branch until one does not raise; the
+# compiled converter only considers the branches that accept the value's
+# Python type (and, for records, its field names), and only tries the next
+# one if a conversion fails after all.
+
+outputConverters = {}
+
+def compileOutputConverter(t, dobase64=True):
+    key = (json.dumps(t, sort_keys=True), dobase64)
+    converter = outputConverters.get(key)
+    if converter is None:
+        try:
+            converter = buildOutputConverter(t, dobase64)
+        except (KeyError, TypeError):
+            converter = lambda x: convertOut(x, t, dobase64)
+        outputConverters[key] = converter
+    return converter
+
+def valueKind(x):
+    # the branches of a union that can take x: see unionCandidates
+    if x is True or x is False:
+        return "boolean"
+    elif isinstance(x, int):
+        return "int"
+    elif isinstance(x, float):
+        return "float"
+    elif isinstance(x, stringTypes):
+        return "string"
+    elif isinstance(x, nativeBytes):
+        return "bytes"
+    elif isinstance(x, list):
+        return "array"
+    elif isinstance(x, dict):
+        return "map"
+    else:
+        return None
+
+unionCandidates = {"boolean": ("boolean", "int", "long", "float", "double"),
+                   "int": ("int", "long", "float", "double"),
+                   "float": ("float", "double"),
+                   "string": ("string", "bytes", "fixed"),
+                   "bytes": ("bytes", "fixed"),
+                   "array": ("array",),
+                   "map": ("map", "record")}
+
+def buildOutputConverter(t, dobase64):
+    # every converter returns True unchanged, whatever the type, as convertOut
+    # does
+    if t == "null":
+        def convertNull(x):
+            if x is None or x is True:
+                return x
+            raise Exception
+        return convertNull
+
+    elif t == "boolean":
+        def convertBoolean(x):
+            if x is True or x is False:
+                return x
+            raise Exception
+        return convertBoolean
+
+    elif t == "int" or t == "long":
+        def convertInt(x):
+            if isinstance(x, int):
+                return x
+            raise Exception
+        return convertInt
+
+    elif t == "float" or t == "double":
+        def convertDouble(x):
+            if isinstance(x, (int, float)):
+                if math.isinf(x):
+                    if x > 0.0:
+                        return "inf"
+                    else:
+                        return "-inf"
+                elif math.isnan(x):
+                    return "nan"
+                else:
+                    return x
+            raise Exception
+        return convertDouble
+
+    elif t == "string":
+        def convertString(x):
+            if isinstance(x, stringTypes) or x is True:
+                return x
+            raise Exception
+        return convertString
+
+    elif t == "bytes" or (isinstance(t, dict) and t["type"] == "fixed"):
+        if dobase64:
+            def outputBytes(x):
+                if isinstance(x, stringTypes) or isinstance(x, nativeBytes):
+                    return encodeBytes(x)
+                elif x is True:
+                    return x
+                raise Exception
+        else:
+            def outputBytes(x):
+                if isinstance(x, stringTypes) or x is True:
+                    return x
+                raise Exception
+        return outputBytes
+
+    elif isinstance(t, dict) and t["type"] == "array":
+        items = compileOutputConverter(t["items"], dobase64)
+        def convertArray(x):
+            if isinstance(x, list):
+                return [items(v) for v in x]
+            elif x is True:
+                return x
+            raise Exception
+        return convertArray
+
+    elif isinstance(t, dict) and t["type"] == "map":
+        values = compileOutputConverter(t["values"], dobase64)
+        def convertMap(x):
+            if isinstance(x, dict):
+                return {k: values(v) for k, v in x.items()}
+            elif x is True:
+                return x
+            raise Exception
+        return convertMap
+
+    elif isinstance(t, dict) and t["type"] == "record":
+        fields = [(f["name"], compileOutputConverter(f["type"], dobase64)) for f in t["fields"]]
+        names = set(name for name, convert in fields)
+        def convertRecord(x):
+            if isinstance(x, dict) and set(x.keys()) == names:
+                return {name: convert(x[name]) for name, convert in fields}
+            elif x is True:
+                return x
+            raise Exception
+        convertRecord.names = names
+        return convertRecord
+
+    elif isinstance(t, list):
+        return buildUnionOutputConverter(t, dobase64)
+
+    else:
+        def convertOther(x):
+            if x is True:
+                return x
+            raise Exception
+        return convertOther
+
+def buildUnionOutputConverter(t, dobase64):
+    nullable = "null" in t
+    tagged = {}       # convertOut's name for each branch of a tagged value
+    candidates = {}   # valueKind -> [(name, converter, record field names)]
+    for ti in t:
+        if isinstance(ti, dict) and ti["type"] in ("record", "enum", "fixed"):
+            tag = ti["name"]
+        elif isinstance(ti, dict):
+            tag = ti["type"]
+        elif isinstance(ti, stringTypes):
+            tag = ti
+        else:
+            raise TypeError
+        convert = compileOutputConverter(ti, dobase64)
+        if tag not in tagged:
+            tagged[tag] = convert
+
+        if isinstance(ti, dict) and ti["type"] in ("record", "enum", "fixed"):
+            if "namespace" in ti:
+                name = ti["namespace"] + "." + ti["name"]
+            else:
+                name = ti["name"]
+        elif isinstance(ti, dict):
+            name = ti["type"]
+        else:
+            name = ti
+        branchType = ti["type"] if isinstance(ti, dict) else ti
+        for kind, types in unionCandidates.items():
+            if branchType in types:
+                candidates.setdefault(kind, []).append((name, convert, getattr(convert, "names", None)))
+
+    def convertUnion(x):
+        if x is True:
+            return x
+        elif x is None:
+            if nullable:
+                return x
+            raise Exception
+        elif isinstance(x, dict) and len(x) == 1:
+            tag, value = list(x.items())[0]
+            convert = tagged.get(tag)
+            if convert is not None:
+                return {tag: convert(value)}
+            return None
+        for name, convert, names in candidates.get(valueKind(x), ()):
+            if names is not None and set(x.keys()) != names:
+                continue
+            try:
+                out = convert(x)
+            except:
+                pass
+            else:
+                return {name: out}
+        raise Exception
+
+    return convertUnion
+
+# Compiled input converters: compileInputConverter(t) returns a function that
+# does what convertIn(x, t) does, but inspects the type only once, when it is
+# compiled, and finds union branches by tag in a dict.  Converters are cached
+# by the type's JSON, so each distinct input type is compiled once per run.
+
+inputConverters = {}
+
+def compileInputConverter(t):
+    key = json.dumps(t, sort_keys=True)
+    converter = inputConverters.get(key)
+    if converter is None:
+        try:
+            converter = buildInputConverter(t)
+        except (KeyError, TypeError):
+            # a type too odd to compile is left to convertIn
+            converter = lambda x: convertIn(x, t)
+        inputConverters[key] = converter
+    return converter
+
+def unchanged(x):
+    return x
+
+def convertFloat(x):
+    if x == "inf":
+        return float("inf")
+    elif x == "-inf":
+        return float("-inf")
+    elif x == "nan":
+        return float("nan")
+    else:
+        return x
+
+def buildInputConverter(t):
+    if t == "float" or t == "double":
+        return convertFloat
+
+    elif t == "bytes" or (isinstance(t, dict) and t["type"] == "fixed"):
+        return convertBytes
+
+    elif isinstance(t, dict) and t["type"] == "array":
+        items = compileInputConverter(t["items"])
+        if items is unchanged:
+            def convertArray(x):
+                if not isinstance(x, list): raise Exception
+                return list(x)
+        else:
+            def convertArray(x):
+                if not isinstance(x, list): raise Exception
+                return [items(v) for v in x]
+        return convertArray
+
+    elif isinstance(t, dict) and t["type"] == "map":
+        values = compileInputConverter(t["values"])
+        def convertMap(x):
+            if not isinstance(x, dict): raise Exception
+            return {k: values(v) for k, v in x.items()}
+        return convertMap
+
+    elif isinstance(t, dict) and t["type"] == "record":
+        fields = [(f["name"], compileInputConverter(f["type"])) for f in t["fields"]]
+        names = [name for name, convert in fields]
+        fields = [(name, convert) for name, convert in fields if convert is not unchanged]
+        def convertRecord(x):
+            if not isinstance(x, dict): raise Exception
+            out = {name: x[name] for name in names}
+            for name, convert in fields:
+                out[name] = convert(out[name])
+            return out
+        return convertRecord
+
+    elif isinstance(t, list):
+        if not all(isinstance(ti, (dict,) + stringTypes) for ti in t):
+            return lambda x: convertIn(x, t)
+        branches = {}
+        for ti in t:
+            if isinstance(ti, dict) and ti["type"] in ("record", "enum", "fixed"):
+                name = ti["name"]
+            elif isinstance(ti, dict):
+                name = ti["type"]
+            else:
+                name = ti
+            if name not in branches:
+                branches[name] = compileInputConverter(ti)
+        def convertUnion(x):
+            if x is None:
+                return x
+            tag, value = list(x.items())[0]
+            convert = branches.get(tag)
+            if convert is not None:
+                return {tag: convert(value)}
+        return convertUnion
+
+    else:
+        return unchanged
+
 def checkInputType(x, t, typeNames):
     if t == "null":
         if x is not None:
@@ -153,12 +499,12 @@ def checkInputType(x, t, typeNames):
         if not isinstance(x, (int, float)):
             raise TypeError("Input incorrectly prepared: " + repr(x) + " " + json.dumps(t))
     elif t == "string":
-        if not isinstance(x, str):
+        if not isinstance(x, stringTypes):
             raise TypeError("Input incorrectly prepared: " + repr(x) + " " + json.dumps(t))
     elif t == "bytes":
-        if not isinstance(x, str):
+        if not isinstance(x, stringTypes):
             raise TypeError("Input incorrectly prepared: " + repr(x) + " " + json.dumps(t))
-    elif isinstance(t, str):
+    elif isinstance(t, stringTypes):
         t = typeNames[t]
     if isinstance(t, dict) and t["type"] == "array":
         if not isinstance(x, list):
@@ -176,10 +522,10 @@ def checkInputType(x, t, typeNames):
         for f in t["fields"]:
             checkInputType(x[f["name"]], f["type"], typeNames)
     elif isinstance(t, dict) and t["type"] == "fixed":
-        if not isinstance(x, str):
+        if not isinstance(x, stringTypes):
             raise TypeError("Input incorrectly prepared: " + repr(x) + " " + json.dumps(t))
     elif isinstance(t, dict) and t["type"] == "enum":
-        if not isinstance(x, str):
+        if not isinstance(x, stringTypes):
             raise TypeError("Input incorrectly prepared: " + repr(x) + " " + json.dumps(t))
     elif isinstance(t, list):
         if x is None:
@@ -193,7 +539,7 @@ def checkInputType(x, t, typeNames):
                     name = ti["name"]
                 elif isinstance(ti, dict):
                     name = ti["type"]
-                elif isinstance(ti, str):
+                elif isinstance(ti, stringTypes):
                     name = ti
                 if tag == name:
                     found = True
@@ -202,10 +548,165 @@ def checkInputType(x, t, typeNames):
                 raise TypeError("Input incorrectly prepared: " + repr(x) + " " + json.dumps(t))
         else:
             raise TypeError("Input incorrectly prepared: " + repr(x) + " " + json.dumps(t))
-    elif not isinstance(t, str):
+    elif not isinstance(t, stringTypes):
         raise TypeError("Input incorrectly prepared: " + repr(x) + " " + json.dumps(t))
     return x
 
+# Compiled input validators: compileInputValidator(t, typeNames) returns a
+# function that raises the same TypeError as checkInputType(x, t, typeNames)
+# for a badly prepared x.  Named types are resolved while compiling (each
+# once, so recursive types work), record field names are collected into sets
+# once, and error messages are only built for the value that fails.
+# exampleValidator caches the validator of each example's input type and
+# type names by their JSON, as written (the error messages show the types).
+
+inputValidators = {}
+
+def invalidInput(x, t):
+    raise TypeError("Input incorrectly prepared: " + repr(x) + " " + json.dumps(t))
+
+def exampleValidator(example, ordered=False):
+    inputType = example["engine"]["input"]
+    fcns = [x for x in example["engine"]["action"][example["function"]] if isinstance(x, dict) and "params" in x]
+    key = json.dumps([inputType, fcns, ordered])
+    validate = inputValidators.get(key)
+    if validate is None:
+        typeNames = getNamesFromFunctions(fcns)
+        typeNames.update(getNamesFromType(inputType))
+        validate = inputValidators[key] = compileInputValidator(inputType, typeNames, ordered)
+    return validate
+
+primitiveInstances = {"int": int, "long": int, "float": (int, float), "double": (int, float), "string": stringTypes, "bytes": stringTypes}
+
+def compileInputValidator(t, typeNames, ordered=False):
+    # with ordered=True, records must also have their members in field order
+    named = {}
+
+    def resolve(name):
+        # a validator for the named type, compiled on first use; the lookup
+        # is deferred so that a type can refer to itself
+        if name not in named:
+            named[name] = None
+            if name in typeNames:
+                named[name] = build(typeNames[name])
+            else:
+                def unknown(x):
+                    raise KeyError(name)
+                named[name] = unknown
+        validate = named[name]
+        if validate is None:
+            return lambda x: named[name](x)
+        return validate
+
+    def build(t):
+        if t == "null":
+            def validateNull(x):
+                if x is not None:
+                    invalidInput(x, t)
+            return validateNull
+        elif t == "boolean":
+            def validateBoolean(x):
+                if x is not True and x is not False:
+                    invalidInput(x, t)
+            return validateBoolean
+        elif isinstance(t, stringTypes) and t in primitiveInstances:
+            instance = primitiveInstances[t]
+            def validatePrimitive(x):
+                if not isinstance(x, instance):
+                    invalidInput(x, t)
+            return validatePrimitive
+        elif isinstance(t, stringTypes):
+            return resolve(t)
+
+        elif isinstance(t, dict) and t["type"] == "array":
+            if isinstance(t["items"], stringTypes) and t["items"] in primitiveInstances:
+                instance = primitiveInstances[t["items"]]
+                def validateArray(x):
+                    if not isinstance(x, list):
+                        invalidInput(x, t)
+                    for v in x:
+                        if not isinstance(v, instance):
+                            invalidInput(v, t["items"])
+            else:
+                items = build(t["items"])
+                def validateArray(x):
+                    if not isinstance(x, list):
+                        invalidInput(x, t)
+                    for v in x:
+                        items(v)
+            return validateArray
+
+        elif isinstance(t, dict) and t["type"] == "map":
+            values = build(t["values"])
+            def validateMap(x):
+                if not isinstance(x, dict):
+                    invalidInput(x, t)
+                for v in x.values():
+                    values(v)
+            return validateMap
+
+        elif isinstance(t, dict) and t["type"] == "record":
+            names = set(f["name"] for f in t["fields"])
+            fields = [(f["name"], build(f["type"])) for f in t["fields"]]
+            if ordered:
+                names = [f["name"] for f in t["fields"]]
+                def validateRecord(x):
+                    if not isinstance(x, dict) or list(x.keys()) != names:
+                        invalidInput(x, t)
+                    for name, validate in fields:
+                        validate(x[name])
+                return validateRecord
+            def validateRecord(x):
+                if not isinstance(x, dict) or set(x.keys()) != names:
+                    invalidInput(x, t)
+                for name, validate in fields:
+                    validate(x[name])
+            return validateRecord
+
+        elif isinstance(t, dict) and t["type"] in ("fixed", "enum"):
+            def validateString(x):
+                if not isinstance(x, stringTypes):
+                    invalidInput(x, t)
+            return validateString
+
+        elif isinstance(t, list):
+            if not all(isinstance(ti, (dict,) + stringTypes) for ti in t):
+                return lambda x: checkInputType(x, t, typeNames)
+            nullable = "null" in t
+            branches = {}
+            for ti in t:
+                if isinstance(ti, dict) and ti["type"] in ("record", "enum", "fixed"):
+                    name = ti["name"]
+                elif isinstance(ti, dict):
+                    name = ti["type"]
+                else:
+                    name = ti
+                branches.setdefault(name, []).append(build(ti))
+            def validateUnion(x):
+                if x is None:
+                    if not nullable:
+                        invalidInput(x, t)
+                elif isinstance(x, dict) and len(x) == 1:
+                    tag, value = list(x.items())[0]
+                    if tag not in branches:
+                        invalidInput(x, t)
+                    for validate in branches[tag]:
+                        validate(value)
+                else:
+                    invalidInput(x, t)
+            return validateUnion
+
+        else:
+            def validateOther(x):
+                invalidInput(x, t)
+            return validateOther
+
+    try:
+        validate = build(t)
+    except (KeyError, TypeError):
+        return lambda x: checkInputType(x, t, typeNames)
+    return validate
+
 def getNamesFromType(t):
     if isinstance(t, dict) and t["type"] == "array":
         return getNamesFromType(t["items"])
@@ -236,50 +737,1602 @@ def getNamesFromFunctions(fcns):
         out.update(getNamesFromType(fcn["ret"]))
     return out
 
-def convertInput(example):
-    inputType = example["engine"]["input"]
-    typeNames = getNamesFromFunctions([x for x in example["engine"]["action"][example["function"]] if isinstance(x, dict) and "params" in x])
-    typeNames.update(getNamesFromType(inputType))
+# bump whenever convertIn or checkInputType change what they produce, so that
+# corpora stored in converted form are rebuilt
+CONVERTER_VERSION = 1
+
+# Samples already in their final form: convertIn only changes "inf"/"-inf"/
+# "nan" strings where a number is expected, base64 strings where bytes are
+# expected, records with members out of field order or that are not fields,
+# and unknown union tags.  So if the input type has no bytes (as convertIn
+# sees it) and a sample passes validation with records in field order, the
+# sample is the one the JSON decoder built, with no sentinel strings left, and
+# it is used as it is instead of being walked and copied by convertIn.
+
+def convertsBytes(t):
+    if t == "bytes" or (isinstance(t, dict) and t.get("type") == "fixed"):
+        return True
+    elif isinstance(t, dict) and t.get("type") == "array":
+        return convertsBytes(t.get("items"))
+    elif isinstance(t, dict) and t.get("type") == "map":
+        return convertsBytes(t.get("values"))
+    elif isinstance(t, dict) and t.get("type") == "record":
+        return any(convertsBytes(f.get("type")) for f in t.get("fields", []))
+    elif isinstance(t, list):
+        return any(convertsBytes(ti) for ti in t)
+    else:
+        return False
+
+def inputConverter(example, reuseParsed=True):
+    # returns the function convertInput applies to each trial of example
+    convert = compileInputConverter(example["engine"]["input"])
+    validate = exampleValidator(example)
+    if not reuseParsed or convertsBytes(example["engine"]["input"]):
+        isFinal = None
+    else:
+        isFinal = exampleValidator(example, ordered=True)
+    def convertTrial(trial):
+        if isFinal is not None:
+            try:
+                isFinal(trial["sample"])
+                return trial
+            except (TypeError, KeyError):
+                pass
+        sample = convert(trial["sample"])
+        validate(sample)
+        return dict(trial, sample=sample)
+    return convertTrial
+
+def convertInput(example, reuseParsed=True):
+    convertTrial = inputConverter(example, reuseParsed)
     try:
-        trials = [dict(x, sample=checkInputType(convertIn(x["sample"], inputType), inputType, typeNames)) for x in example["trials"]]
+        trials = [convertTrial(x) for x in example["trials"]]
     except TypeError:
         print(example["function"] + "\t" + json.dumps(example["engine"]))
         raise
     return dict(example, trials=trials)
 
-def getExamples(openFile):
-    # take advantage of the formatting of the file to find breaks between examples
-    inFunction = False
-    collectedString = []
-    for line in openFile:
-        if line.startswith("""     {"function":"""):
-            inFunction = True
-        elif line == """     },\n""" or line == """     }\n""":
-            inFunction = False
-            collectedString.append("}")
-            yield convertInput(json.loads("".join(collectedString)))
-            collectedString = []
-        if inFunction:
-            collectedString.append(line)
+# Columnar conversion, an opt-in alternative to convertInput for callers
+# that can take columns: sampleColumns converts all of an example's (raw)
+# samples at once into one column per field of its Input record: NumPy
+# float64 for float and double fields, with the "inf"/"-inf"/"nan" strings
+# replaced by vector comparisons, int64 for int and long fields, and lists of
+# converted values (decoded bytes, arrays, unions...) for the rest.  It
+# returns None, and the caller falls back to the row-by-row convertInput, if
+# NumPy is not installed, the input is not a flat record of its samples, or
+# any value is not exactly of its field's type (convertInput then reports the
+# error as usual).  Like convertIn, it ignores members of a sample that are
+# not fields.  The runners do not call it; benchmark.py columns compares the
+# two.
+
+SampleColumns = namedtuple("SampleColumns", ["names", "columns", "length"])
+
+def sampleColumns(example):
+    try:
+        import numpy
+    except ImportError:
+        return None
+    inputType = example["engine"]["input"]
+    if not isinstance(inputType, dict) or inputType.get("type") != "record":
+        return None
+    samples = [x["sample"] for x in example["trials"]]
+    names = [f["name"] for f in inputType["fields"]]
+    nameSet = set(names)
+    if not all(isinstance(x, dict) and nameSet.issubset(x) for x in samples):
+        return None
+
+    typeNames = None
+    columns = {}
+    for f in inputType["fields"]:
+        values = [x[f["name"]] for x in samples]
+        kinds = set(map(type, values))
+        if f["type"] in ("float", "double") and kinds <= set([int, float, str]):
+            if str in kinds:
+                values = numpy.array(values, dtype=object)
+                for sentinel, value in ("inf", numpy.inf), ("-inf", -numpy.inf), ("nan", numpy.nan):
+                    values[values == sentinel] = value
+                if str in set(map(type, values)):
+                    return None
+            if int in kinds and max(abs(v) for v in values if type(v) is int) > 2**53:
+                # not exactly representable as a double
+                return None
+            columns[f["name"]] = numpy.array(values, dtype=numpy.float64)
+        elif f["type"] in ("int", "long") and kinds <= set([int]):
+            try:
+                columns[f["name"]] = numpy.array(values, dtype=numpy.int64)
+            except OverflowError:
+                return None
+        else:
+            if typeNames is None:
+                typeNames = getNamesFromFunctions([x for x in example["engine"]["action"][example["function"]] if isinstance(x, dict) and "params" in x])
+                typeNames.update(getNamesFromType(inputType))
+            convert = compileInputConverter(f["type"])
+            validate = compileInputValidator(f["type"], typeNames)
+            try:
+                column = [convert(v) for v in values]
+                for v in column:
+                    validate(v)
+            except Exception:
+                return None
+            columns[f["name"]] = column
+    return SampleColumns(names, columns, len(samples))
+
+class ConvertCache(object):
+    # A directory of pickled convertInput results, one file per example named
+    # by the SHA-1 of the example's text, so an edited example simply misses.
+    # Results live in a subdirectory per CONVERTER_VERSION and Python major
+    # version (their strings and bytes differ); directories of older converter
+    # versions are deleted when the cache is opened.  trim() deletes the least
+    # recently used results until the cache fits in maxBytes.
+
+    def __init__(self, directory, maxBytes=None):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.current = os.path.join(directory, "v%d-py%d" % (CONVERTER_VERSION, sys.version_info[0]))
+        if not os.path.isdir(self.current):
+            os.makedirs(self.current)
+        for name in os.listdir(directory):
+            m = re.match(r"^v([0-9]+)-py([0-9]+)$", name)
+            if m is not None and int(m.group(1)) < CONVERTER_VERSION and int(m.group(2)) == sys.version_info[0]:
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    def path(self, contentHash):
+        return os.path.join(self.current, contentHash + ".pickle")
+
+    def get(self, contentHash):
+        path = self.path(contentHash)
+        try:
+            with open(path, "rb") as cached:
+                example = pickle.load(cached)
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        return example
+
+    def put(self, contentHash, example):
+        path = self.path(contentHash)
+        temporary = "%s.%d.tmp" % (path, os.getpid())
+        with open(temporary, "wb") as out:
+            pickle.dump(example, out, 2)
+        os.rename(temporary, path)
+
+    def convert(self, contentHash, example):
+        out = self.get(contentHash)
+        if out is None:
+            out = convertInput(example)
+            self.put(contentHash, out)
+        return out
+
+    def trim(self):
+        if self.maxBytes is None:
+            return
+        files = []
+        for name in os.listdir(self.current):
+            try:
+                info = os.stat(os.path.join(self.current, name))
+            except OSError:
+                continue
+            files.append((info.st_mtime, info.st_size, name))
+        files.sort()
+        total = sum(size for mtime, size, name in files)
+        for mtime, size, name in files:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(os.path.join(self.current, name))
+            except OSError:
+                pass
+            total -= size
+
+CorpusEntry = namedtuple("CorpusEntry", ["number", "offset", "length", "text", "example", "error"])
+
+class CorpusScanner(object):
+    # Finds the elements of the "pfa-tests" array without relying on how the
+    # file is laid out (pretty-printed, minified, all on one line...).  The file
+    # is read in chunks and each example is handed to the C JSON decoder where
+    # it lies in the buffer; only examples that fail to decode are delimited by
+    # the slower bracket-counting scan, so that a malformed example can be
+    # skipped instead of ending the run.
+
+    structural = re.compile(r'["\[\]{}]')
+    stringEnd = re.compile(r'["\\]')
+    scalarEnd = re.compile(r'[\s,\]}]')
+    whitespace = re.compile(r'[ \t\n\r]*')
+    separators = re.compile(r'[ \t\n\r,]*')
+
+    def __init__(self, openFile, chunkSize=16777216):
+        self.openFile = openFile
+        self.rawFile = getattr(openFile, "buffer", openFile)
+        self.chunkSize = chunkSize
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0           # current position in self.buf
+        self.offset = 0        # byte offset of self.buf[self.pos] in the file
+        self.exhausted = False
+        self.header = {}       # top-level keys other than "pfa-tests"
+
+    @staticmethod
+    def byteLength(text):
+        return len(text.encode("utf-8"))
+
+    def refill(self, size=None):
+        # drops everything before self.pos and appends the next chunk; returns
+        # how far the buffer shifted, or -1 at the end of the file
+        if self.exhausted:
+            return -1
+        data = self.rawFile.read(max(self.chunkSize, size or 0))
+        if isinstance(data, bytes):
+            data = self.utf8.decode(data, not data)
+        if not data:
+            self.exhausted = True
+            return -1
+        shift = self.pos
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return shift
+
+    def skip(self, pattern):
+        while True:
+            end = pattern.match(self.buf, self.pos).end()
+            self.offset += end - self.pos
+            self.pos = end
+            if end < len(self.buf):
+                return self.buf[end]
+            if self.refill() < 0:
+                return None
+
+    def valueEnd(self):
+        # end of the JSON value starting at self.pos, found by counting
+        # brackets outside of strings (None if the file ends first)
+        if self.buf[self.pos] not in "{[\"":
+            j = self.pos + 1
+            while True:
+                m = self.scalarEnd.search(self.buf, j)
+                if m is not None:
+                    return m.start()
+                j = len(self.buf)
+                shift = self.refill()
+                if shift < 0:
+                    return j
+                j -= shift
+        j = self.pos
+        openers = []
+        inString = False
+        while True:
+            m = (self.stringEnd if inString else self.structural).search(self.buf, j)
+            if m is None:
+                j = max(j, len(self.buf))
+                shift = self.refill()
+                if shift < 0:
+                    return None
+                j -= shift
+                continue
+            c = m.group()
+            j = m.end()
+            if inString:
+                if c == "\\":
+                    j += 1
+                    continue
+                inString = False
+                if not openers:
+                    return j
+            elif c == '"':
+                inString = True
+            elif c == "{" or c == "[":
+                openers.append(c)
+            else:
+                # a mismatched bracket closes everything back to its partner
+                partner = "{" if c == "}" else "["
+                while openers and openers.pop() != partner:
+                    pass
+                if not openers:
+                    return j
+
+    def readValue(self):
+        # returns (value, end, error) for the JSON value starting at self.pos
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError as err:
+                position = getattr(err, "pos", -1)
+                truncated = position >= len(self.buf) - 16 or str(err).startswith("Unterminated string")
+                if truncated and self.refill(len(self.buf) - self.pos) >= 0:
+                    continue
+                break
+            if end == len(self.buf) and self.refill() >= 0:
+                continue
+            return value, end, None
+
+        end = self.valueEnd()
+        if end is None:
+            raise ValueError("corpus ends in the middle of a value at byte %d" % self.offset)
+        try:
+            return json.loads(self.buf[self.pos:end]), end, None
+        except ValueError as err:
+            return None, end, err
+
+    def readMembers(self, arrayKey="pfa-tests"):
+        # reads top-level "key": value pairs into self.header, stopping at the
+        # start of the arrayKey array (True) or the end of the object (False)
+        while True:
+            c = self.skip(self.separators)
+            if c is None or c == "}":
+                return False
+            key, end, err = self.readValue()
+            if err is not None or not isinstance(key, stringTypes):
+                raise ValueError("expected a key at byte %d of the corpus" % self.offset)
+            self.offset += self.byteLength(self.buf[self.pos:end])
+            self.pos = end
+            if self.skip(self.whitespace) != ":":
+                raise ValueError("expected ':' at byte %d of the corpus" % self.offset)
+            self.offset += 1
+            self.pos += 1
+            c = self.skip(self.whitespace)
+            if key == arrayKey and c == "[":
+                self.offset += 1
+                self.pos += 1
+                return True
+            value, end, err = self.readValue()
+            if err is not None:
+                raise ValueError("malformed value for %s at byte %d of the corpus: %s" % (json.dumps(key), self.offset, err))
+            self.header[key] = value
+            self.offset += self.byteLength(self.buf[self.pos:end])
+            self.pos = end
+
+    def entries(self):
+        c = self.skip(self.whitespace)
+        if c == "[":
+            self.offset += 1
+            self.pos += 1
+            topLevelArray = True
+        elif c == "{":
+            self.offset += 1
+            self.pos += 1
+            topLevelArray = False
+            if not self.readMembers():
+                return
+        else:
+            raise ValueError("corpus must be a JSON object with a \"pfa-tests\" array or a JSON array of examples")
+
+        # a shard written by shardCorpus lists the original numbers of its
+        # examples (as printed, counting from 1) in "pfa-numbers"
+        numbers = self.header.get("pfa-numbers")
+        for i, (offset, length, text, example, err) in enumerate(self.elements("pfa-tests")):
+            number = i if numbers is None or i >= len(numbers) else numbers[i] - 1
+            yield CorpusEntry(number, offset, length, text, example, err)
+
+        if not topLevelArray:
+            self.readMembers()
+
+    def elements(self, arrayKey):
+        # yields (offset, length, text, value, error) for each element of the
+        # array whose "[" was just read, leaving self.pos after its "]"
+        while True:
+            c = self.skip(self.separators)
+            if c is None:
+                raise ValueError("corpus ends inside the \"%s\" array" % arrayKey)
+            if c == "]":
+                self.offset += 1
+                self.pos += 1
+                return
+            value, end, err = self.readValue()
+            text = self.buf[self.pos:end]
+            length = self.byteLength(text)
+            yield self.offset, length, text, value, err
+            self.offset += length
+            self.pos = end
+
+# Corpora may be compressed; the format is chosen by file name extension.  A
+# corpus written through ChunkedWriter is a sequence of independent members
+# (gzip members, xz or bzip2 streams, zstd frames) that each start at an
+# example, so openCorpus and the standard tools read it as one stream while
+# ChunkedReader can decompress just the member holding a given example.
+
+compressionFormats = [(".gz", "gzip"), (".xz", "xz"), (".bz2", "bzip2"), (".zst", "zstd")]
+
+def compressionFormat(fileName):
+    for suffix, format in compressionFormats:
+        if fileName.endswith(suffix):
+            return format
+    return None
+
+def newCompressor(format):
+    if format == "gzip":
+        import zlib
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    elif format == "xz":
+        import lzma
+        return lzma.LZMACompressor(lzma.FORMAT_XZ)
+    elif format == "bzip2":
+        import bz2
+        return bz2.BZ2Compressor()
+    elif format == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError("unknown compression format: %r" % format)
+
+def newDecompressor(format):
+    if format == "gzip":
+        import zlib
+        return zlib.decompressobj(31)
+    elif format == "xz":
+        import lzma
+        return lzma.LZMADecompressor()
+    elif format == "bzip2":
+        import bz2
+        return bz2.BZ2Decompressor()
+    elif format == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError("unknown compression format: %r" % format)
+
+def openCorpus(fileName):
+    # a binary file object that reads the (decompressed) corpus as a stream
+    format = compressionFormat(fileName)
+    if format is None:
+        return open(fileName, "rb")
+    elif format == "gzip":
+        import gzip
+        return gzip.open(fileName, "rb")
+    elif format == "xz":
+        import lzma
+        return lzma.open(fileName, "rb")
+    elif format == "bzip2":
+        import bz2
+        return bz2.open(fileName, "rb")
+    else:
+        import io
+        import zstandard
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(fileName, "rb"), read_across_frames=True))
+
+class ChunkedWriter(object):
+    # Writes a corpus, compressed if the file name asks for it.  Call
+    # exampleBoundary() just before each example: once the current member
+    # holds chunkSize bytes it is finished there and a new one begins.  close()
+    # returns [uncompressed offset, compressed offset] for every member.
+
+    def __init__(self, fileName, chunkSize=1048576):
+        self.format = compressionFormat(fileName)
+        self.file = open(fileName, "wb")
+        self.chunkSize = chunkSize
+        self.compressor = None
+        self.written = 0
+        self.chunks = []
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        if self.format is None:
+            self.file.write(data)
+        else:
+            if self.compressor is None:
+                self.chunks.append([self.written, self.file.tell()])
+                self.compressor = newCompressor(self.format)
+            self.file.write(self.compressor.compress(data))
+        self.written += len(data)
+
+    def endChunk(self):
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush())
+            self.compressor = None
+
+    def exampleBoundary(self):
+        if self.compressor is not None and self.written - self.chunks[-1][0] >= self.chunkSize:
+            self.endChunk()
+
+    def close(self):
+        self.endChunk()
+        self.file.close()
+        return self.chunks
+
+class ChunkedReader(object):
+    # Random access to a corpus written by ChunkedWriter, given its chunk table
+    # (kept in the index): only the member containing the requested bytes is
+    # decompressed, and the last one is kept for the next request.
+
+    def __init__(self, fileName, chunks):
+        self.format = compressionFormat(fileName)
+        self.file = open(fileName, "rb")
+        self.starts = [x[0] for x in chunks]
+        self.chunks = chunks
+        self.cached = None
+        self.data = b""
+
+    def chunk(self, i):
+        if self.cached != i:
+            self.file.seek(self.chunks[i][1])
+            decompressor = newDecompressor(self.format)
+            pieces = []
+            while not decompressor.eof:
+                data = self.file.read(1048576)
+                if not data:
+                    break
+                pieces.append(decompressor.decompress(data))
+            self.cached = i
+            self.data = b"".join(pieces)
+        return self.data
+
+    def read(self, offset, length):
+        i = bisect.bisect_right(self.starts, offset) - 1
+        start = offset - self.starts[i]
+        return self.chunk(i)[start:start + length]
+
+def compressCorpus(inputFile, outputFile, chunkSize=1048576):
+    # Copies a corpus byte for byte into a chunked (usually compressed) file
+    # and writes its index, including the chunk table.
+    writer = ChunkedWriter(outputFile, chunkSize)
+    source = openCorpus(inputFile)
+    copied = 0
+    entries = []
+    for entry in CorpusScanner(openCorpus(inputFile)).entries():
+        copyBytes(source, writer, entry.offset - copied)
+        writer.exampleBoundary()
+        copyBytes(source, writer, entry.length)
+        copied = entry.offset + entry.length
+        entries.append(indexEntry(entry))
+    copyBytes(source, writer, None)
+    chunks = writer.close()
+    return writeIndex(outputFile, indexFileName(outputFile), entries, chunks=chunks)
+
+def copyBytes(source, writer, count):
+    # copies count bytes (or everything, if count is None) from source to writer
+    while count is None or count > 0:
+        data = source.read(1048576 if count is None else min(count, 1048576))
+        if not data:
+            break
+        writer.write(data)
+        if count is not None:
+            count -= len(data)
+
+IndexEntry = namedtuple("IndexEntry", ["number", "offset", "length", "trials", "hash", "function"])
+
+INDEX_VERSION = 1
+
+def indexFileName(inputFile):
+    return inputFile + ".idx"
+
+def corpusStamp(inputFile):
+    info = os.stat(inputFile)
+    return {"size": info.st_size, "mtime": info.st_mtime}
+
+def indexEntry(entry):
+    if entry.error is None:
+        trials = len(entry.example.get("trials", []))
+        function = entry.example.get("function", "")
+    else:
+        trials = 0
+        function = ""
+    contentHash = hashlib.sha1(entry.text.encode("utf-8")).hexdigest()
+    return IndexEntry(entry.number, entry.offset, entry.length, trials, contentHash, function)
+
+def writeIndex(inputFile, indexFile, entries, **extra):
+    # The index is a sidecar text file: a "# {...}" header describing the
+    # corpus it was built from, then one tab-separated line per example with
+    # its number, byte offset, byte length, trial count, SHA-1 of its text
+    # and function name.  Offsets are in the decompressed corpus; the header
+    # of a chunked compressed corpus also lists its chunks.
+    header = corpusStamp(inputFile)
+    header.update(extra)
+    header["version"] = INDEX_VERSION
+    header["corpusHash"] = hashlib.sha1("".join(x.hash for x in entries).encode("ascii")).hexdigest()
+
+    out = open(indexFile, "w")
+    out.write("# " + json.dumps(header, sort_keys=True) + "\n")
+    for x in entries:
+        out.write("%d\t%d\t%d\t%d\t%s\t%s\n" % x)
+    out.close()
+    return header, entries
+
+def buildIndex(inputFile, indexFile=None):
+    if indexFile is None:
+        indexFile = indexFileName(inputFile)
+    entries = [indexEntry(x) for x in CorpusScanner(openCorpus(inputFile)).entries()]
+    return writeIndex(inputFile, indexFile, entries)
+
+def requireIndex(inputFile, purpose):
+    # loadIndex, building the index first if it is missing or out of date
+    index = loadIndex(inputFile)
+    if index is None:
+        sys.stderr.write("indexing %s for %s\n" % (inputFile, purpose))
+        index = buildIndex(inputFile)
+    return index
+
+def loadIndex(inputFile, indexFile=None):
+    # returns (header, entries), or None if there is no index or it was built
+    # from a different version of the corpus
+    if indexFile is None:
+        indexFile = indexFileName(inputFile)
+    if not os.path.exists(indexFile):
+        return None
+    lines = open(indexFile)
+    header = json.loads(next(lines)[2:])
+    if header.get("version") != INDEX_VERSION or any(header.get(k) != v for k, v in corpusStamp(inputFile).items()):
+        return None
+    entries = []
+    for line in lines:
+        number, offset, length, trials, contentHash, function = line.rstrip("\n").split("\t")
+        entries.append(IndexEntry(int(number), int(offset), int(length), int(trials), contentHash, function))
+    return header, entries
+
+def selectionPredicate(selections):
+    # Each selection is an example number or range as printed by the runners
+    # ("17", "100-200", "6000-"), a glob on the function name ("prob.dist.*QF")
+    # or a function name or namespace prefix ("m.pi", "prob.dist").  The
+    # predicate takes a 0-based example number and a function name.
+    ranges = []
+    patterns = []
+    for selection in selections:
+        m = re.match(r"^([0-9]+)(-([0-9]*))?$", selection)
+        if m is not None:
+            low = int(m.group(1))
+            if m.group(2) is None:
+                high = low
+            elif m.group(3):
+                high = int(m.group(3))
+            else:
+                high = None
+            ranges.append((low, high))
+        else:
+            patterns.append(selection)
+
+    def predicate(number, function):
+        for low, high in ranges:
+            if low <= number + 1 and (high is None or number + 1 <= high):
+                return True
+        for pattern in patterns:
+            if any(c in pattern for c in "*?["):
+                if fnmatch.fnmatchcase(function, pattern):
+                    return True
+            elif function == pattern or function.startswith(pattern.rstrip(".") + "."):
+                return True
+        return False
+
+    return predicate
+
+def selectEntries(entries, selections):
+    predicate = selectionPredicate(selections)
+    return [x for x in entries if predicate(x.number, x.function)]
+
+class IndexedReader(object):
+    # Reads indexed examples by offset: through a memory map for a plain
+    # corpus, chunk by chunk for a chunked compressed one, and by (forward)
+    # seeking in the decompressed stream otherwise.
+
+    def __init__(self, fileName, header):
+        if "chunks" in header:
+            self.reader = ChunkedReader(fileName, header["chunks"])
+            self.read = self.reader.read
+        elif compressionFormat(fileName) is None:
+            self.reader = CorpusMap(fileName)
+            self.read = lambda offset, length: self.reader.map[offset:offset + length]
+            self.text = lambda entry: self.reader.text(entry.offset, entry.length)
+        else:
+            self.reader = openCorpus(fileName)
+            self.read = self.readStream
+
+    def readStream(self, offset, length):
+        self.reader.seek(offset)
+        return self.reader.read(length)
+
+    def text(self, entry):
+        return self.read(entry.offset, entry.length).decode("utf-8")
+
+# Sharding: shardCorpus splits a corpus into shards of about equal estimated
+# running time, each a corpus of its own whose "pfa-numbers" keep the
+# original example numbers, so that the runners' reports on the shards can be
+# merged back into the report of a single run (mergeReports.py).  The cost of
+# an example is its trial count times the seconds per trial that its function
+# took in earlier runs (runTestTitus.py --timings), or, for functions without
+# timings, a linear model of its trial count and size, plus the time to parse
+# and convert its text, which the timings do not include.
+
+# least-squares fit to a Titus run over pfa-tests.json
+DEFAULT_SECONDS = 4e-3
+DEFAULT_SECONDS_PER_TRIAL = 4e-6
+DEFAULT_SECONDS_PER_BYTE = 2e-7
+DECODE_SECONDS_PER_BYTE = 8e-8
+
+def loadTimings(fileNames):
+    # returns {function: seconds per trial} from --timings files, whose lines
+    # are example number, function, trial count and seconds
+    seconds = {}
+    trials = {}
+    for fileName in fileNames:
+        for line in open(fileName):
+            number, function, numTrials, numSeconds = line.rstrip("\n").split("\t")
+            seconds[function] = seconds.get(function, 0.0) + float(numSeconds)
+            trials[function] = trials.get(function, 0) + int(numTrials)
+    return dict((function, seconds[function] / max(trials[function], 1)) for function in seconds)
+
+def estimateCost(entry, timings):
+    decode = entry.length * DECODE_SECONDS_PER_BYTE
+    if entry.function in timings:
+        return decode + entry.trials * timings[entry.function]
+    return decode + DEFAULT_SECONDS + entry.trials * DEFAULT_SECONDS_PER_TRIAL + entry.length * DEFAULT_SECONDS_PER_BYTE
+
+def balanceEntries(entries, numShards, timings):
+    # longest-processing-time-first: the most expensive remaining example
+    # goes to the shard with the least estimated cost so far
+    import heapq
+    shards = [(0.0, i, []) for i in range(numShards)]
+    for cost, entry in sorted(((estimateCost(x, timings), x) for x in entries), key=lambda x: (-x[0], x[1].number)):
+        total, i, assigned = heapq.heappop(shards)
+        assigned.append(entry)
+        heapq.heappush(shards, (total + cost, i, assigned))
+    shards.sort(key=lambda x: x[1])
+    return [(total, sorted(assigned, key=lambda x: x.number)) for total, i, assigned in shards]
+
+def shardFileName(inputFile, outputDir, shard, numShards):
+    base = os.path.basename(inputFile)
+    format = compressionFormat(base)
+    if format is not None:
+        base = base[:base.rindex(".")]
+    if base.endswith(".json"):
+        base = base[:-len(".json")]
+    return os.path.join(outputDir, "%s.shard-%d-of-%d.json" % (base, shard + 1, numShards))
+
+def shardCorpus(inputFile, numShards, outputDir, timings={}):
+    # writes the shards and a manifest (shards.json in outputDir); returns
+    # the manifest
+    index = loadIndex(inputFile)
+    if index is None:
+        index = buildIndex(inputFile)
+    header, entries = index
+    corpusMembers = corpusHeader(inputFile)
+    reader = IndexedReader(inputFile, header)
+
+    manifest = {"corpus": os.path.abspath(inputFile), "corpusHash": header["corpusHash"], "examples": len(entries), "shards": []}
+    for shard, (cost, assigned) in enumerate(balanceEntries(entries, numShards, timings)):
+        fileName = shardFileName(inputFile, outputDir, shard, numShards)
+        out = open(fileName, "wb")
+        out.write(b"{")
+        for key, value in corpusMembers.items():
+            if key != "pfa-numbers":
+                out.write(("%s: %s,\n " % (json.dumps(key), json.dumps(value))).encode("utf-8"))
+        out.write(('"pfa-numbers": %s,\n "pfa-tests": [\n' % json.dumps([x.number + 1 for x in assigned])).encode("utf-8"))
+        for i, entry in enumerate(assigned):
+            out.write(b",\n     " if i > 0 else b"     ")
+            out.write(reader.read(entry.offset, entry.length))
+        out.write(b"\n ]}\n")
+        out.close()
+        manifest["shards"].append({"file": os.path.basename(fileName), "examples": len(assigned), "trials": sum(x.trials for x in assigned), "estimatedSeconds": cost, "numbers": [x.number + 1 for x in assigned]})
+
+    out = open(os.path.join(outputDir, "shards.json"), "w")
+    json.dump(manifest, out, indent=1)
+    out.close()
+    return manifest
+
+# A deduplicated corpus (written by dedupCorpus.py) stores each engine that
+# several examples share only once, in a top-level "pfa-engines" object that
+# maps engineHash(engine) to the engine and comes before "pfa-tests".  Those
+# examples have an "engineRef" with the hash instead of an "engine"; the
+# readers put the shared engine back, so every example has an "engine" and
+# examples with the same "engineRef" have the same engine JSON object (which
+# the runners only read; they make an engine instance per example).
+
+def engineHash(engine):
+    return hashlib.sha1(json.dumps(engine, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+class EngineStore(object):
+    # resolves engineRefs; loadEngines returns the "pfa-engines" object and
+    # is only called when the first engineRef is seen
+
+    def __init__(self, loadEngines):
+        self.loadEngines = loadEngines
+        self.engines = None
+
+    def resolve(self, example):
+        if "engineRef" in example and "engine" not in example:
+            if self.engines is None:
+                self.engines = self.loadEngines()
+            if example["engineRef"] not in self.engines:
+                raise ValueError("engineRef %s is not in the corpus's \"pfa-engines\"" % example["engineRef"])
+            example["engine"] = self.engines[example["engineRef"]]
+        return example
+
+def corpusHeader(fileName):
+    # the top-level members of a corpus that come before "pfa-tests"
+    scanner = CorpusScanner(openCorpus(fileName))
+    next(scanner.entries(), None)
+    return scanner.header
+
+def fileEngines(fileName):
+    return EngineStore(lambda: corpusHeader(fileName).get("pfa-engines", {}))
+
+def dedupCorpus(inputFile, outputFile):
+    # Writes a deduplicated copy of a corpus (compressed if outputFile asks
+    # for it) and returns a dict of statistics about the engines it shares.
+    counts = {}
+    firstEngines = {}
+    scanner = CorpusScanner(openCorpus(inputFile))
+    engines = EngineStore(lambda: scanner.header.get("pfa-engines", {}))
+    engineBytes = 0
+    for entry in scanner.entries():
+        if entry.error is None and "engine" in engines.resolve(entry.example):
+            text = json.dumps(entry.example["engine"], sort_keys=True, separators=(",", ":"))
+            contentHash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+            counts[contentHash] = counts.get(contentHash, 0) + 1
+            firstEngines.setdefault(contentHash, entry.example["engine"])
+            engineBytes += len(text)
+    shared = dict((k, firstEngines[k]) for k, v in counts.items() if v > 1)
+
+    scanner = CorpusScanner(openCorpus(inputFile))
+    engines = EngineStore(lambda: scanner.header.get("pfa-engines", {}))
+    writer = ChunkedWriter(outputFile)
+
+    def writeHeader():
+        writer.write("{")
+        for key, value in scanner.header.items():
+            if key != "pfa-engines":
+                writer.write("%s: %s,\n " % (json.dumps(key), json.dumps(value)))
+        writer.write('"pfa-engines": {')
+        for i, contentHash in enumerate(sorted(shared)):
+            writer.write("%s\n     %s: %s" % ("," if i > 0 else "", json.dumps(contentHash), json.dumps(shared[contentHash])))
+        writer.write('\n },\n "pfa-tests": [\n')
+
+    headerWritten = False
+    numExamples = 0
+    for entry in scanner.entries():
+        if not headerWritten:
+            writeHeader()
+            headerWritten = True
+        if entry.error is not None:
+            sys.stderr.write("skipping malformed example %d at byte %d: %s\n" % (entry.number + 1, entry.offset, entry.error))
+            continue
+        example = engines.resolve(entry.example)
+        if "engine" in example:
+            contentHash = engineHash(example["engine"])
+            if contentHash in shared:
+                example = dict((("engineRef", contentHash) if k == "engine" else (k, v)) for k, v in example.items() if k != "engineRef")
+        writer.exampleBoundary()
+        writer.write("%s     %s" % (",\n" if numExamples > 0 else "", json.dumps(example)))
+        numExamples += 1
+    if not headerWritten:
+        writeHeader()
+    writer.write("\n ]}\n")
+    writer.close()
+
+    sharedBytes = sum(len(json.dumps(v, sort_keys=True, separators=(",", ":"))) * (counts[k] - 1) for k, v in shared.items())
+    return {"examples": numExamples,
+            "distinctEngines": len(counts),
+            "sharedEngines": len(shared),
+            "examplesWithSharedEngines": sum(counts[k] for k in shared),
+            "enginesNotParsed": sum(counts[k] - 1 for k in shared),
+            "engineBytes": engineBytes,
+            "engineBytesNotParsed": sharedBytes}
+
+def decodeText(entry, text, engines=None):
+    # returns (number, converted example, error message)
+    try:
+        example = json.loads(text)
+        if engines is not None:
+            engines.resolve(example)
+    except ValueError as err:
+        return entry.number, None, "skipping malformed example %d at byte %d: %s" % (entry.number + 1, entry.offset, err)
+    return entry.number, convertInput(example), None
+
+def decodeEntry(entry, reader, cache=None, engines=None):
+    # like decodeText, but reads the text only if the cache does not have it
+    if cache is not None:
+        example = cache.get(entry.hash)
+        if example is not None:
+            return entry.number, example, None
+    number, example, error = decodeText(entry, reader.text(entry), engines)
+    if cache is not None and example is not None:
+        cache.put(entry.hash, example)
+    return number, example, error
+
+decodeReader = None   # the IndexedReader of each decode-pool worker
+decodeCache = None    # and its ConvertCache, if any
+decodeEngines = None  # and its EngineStore
+
+def initDecodeWorker(fileName, header, cache=None, reader=None):
+    global decodeReader, decodeCache, decodeEngines
+    decodeReader = reader if reader is not None else IndexedReader(fileName, header)
+    decodeCache = cache
+    decodeEngines = fileEngines(fileName)
+
+def decodeIndexed(entry):
+    return decodeEntry(entry, decodeReader, decodeCache, decodeEngines)
+
+def getPooledExamples(fileName, header, entries, numWorkers, readAhead=64, cache=None):
+    # Parsing and convertInput run in numWorkers processes that each read
+    # their examples by offset; results come back in the order of entries,
+    # with at most readAhead examples decoded ahead of the consumer.  A plain
+    # corpus is mapped into memory once, here, and the forked workers inherit
+    # the map, so that they decode their examples from the shared pages and
+    # only (offset, length) entries are sent to them.  Compressed corpora
+    # are read by each worker on its own, as their readers keep a position.
+    import multiprocessing
+    from collections import deque
+    shared = None
+    if "chunks" not in header and compressionFormat(fileName) is None:
+        shared = IndexedReader(fileName, header)
+    pool = multiprocessing.get_context("fork").Pool(numWorkers, initDecodeWorker, (fileName, header, cache, shared))
+    pending = deque()
+    entries = iter(entries)
+    try:
+        while True:
+            while len(pending) < readAhead:
+                entry = next(entries, None)
+                if entry is None:
+                    break
+                pending.append(pool.apply_async(decodeIndexed, (entry,)))
+            if not pending:
+                break
+            number, example, error = pending.popleft().get()
+            if error is not None:
+                sys.stderr.write(error + "\n")
+                continue
+            yield number, example
+    finally:
+        pool.terminate()
+        pool.join()
+        if shared is not None:
+            shared.reader.close()
+
+class RangeFile(object):
+    # a file-like view of length bytes at offset, read through an IndexedReader
+
+    def __init__(self, reader, offset, length):
+        self.reader = reader
+        self.offset = offset
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.reader.read(self.offset, size)
+        self.offset += size
+        self.remaining -= size
+        return data
+
+class LazyExample(dict):
+    # An example whose trials are parsed and converted one at a time as they
+    # are iterated, so that memory use is bounded by one trial (and a chunk of
+    # text) instead of the whole example.  openText returns a new file-like
+    # object over the example's text.  Members before "trials" are read right
+    # away; members after it (there are none in pfa-tests.json) only once the
+    # trials have been iterated.
+
+    chunkSize = 1048576
+
+    def __init__(self, openText, numTrials=None, engines=None):
+        dict.__init__(self)
+        self.openText = openText
+        scanner, hasTrials = self.open()
+        self.update(scanner.header)
+        if engines is not None:
+            engines.resolve(self)
+        if hasTrials:
+            # the trials cannot be converted without the engine's input type
+            missing = [x for x in ("function", "engine") if x not in self]
+            if missing:
+                raise ValueError("%s must come before \"trials\" to read the trials lazily" % " and ".join("\"%s\"" % x for x in missing))
+            self["trials"] = LazyTrials(self, inputConverter(self), numTrials)
+
+    def open(self):
+        # returns a CorpusScanner positioned at the start of the trials and
+        # whether there are any
+        scanner = CorpusScanner(self.openText(), self.chunkSize)
+        if scanner.skip(scanner.whitespace) != "{":
+            raise ValueError("example is not a JSON object")
+        scanner.offset += 1
+        scanner.pos += 1
+        return scanner, scanner.readMembers("trials")
+
+class LazyTrials(object):
+    def __init__(self, example, convertTrial, numTrials=None):
+        self.example = example
+        self.convertTrial = convertTrial
+        self.numTrials = numTrials
+
+    def __len__(self):
+        if self.numTrials is None:
+            scanner, hasTrials = self.example.open()
+            self.numTrials = sum(1 for x in scanner.elements("trials"))
+        return self.numTrials
+
+    def __iter__(self):
+        scanner, hasTrials = self.example.open()
+        for offset, length, text, trial, err in scanner.elements("trials"):
+            if err is not None:
+                sys.stderr.write("skipping malformed trial of %s at byte %d of the example: %s\n" % (self.example.get("function"), offset, err))
+                continue
+            yield self.convertTrial(trial)
+        scanner.readMembers("trials")
+        self.example.update(scanner.header)
+
+def getNumberedExamples(openFile, select=None, decodeWorkers=0, readAhead=64, cache=None, lazy=False, skip=None, binary=False):
+    # openFile may be an open file or the name of a (possibly compressed)
+    # corpus.  With decodeWorkers > 0, examples are parsed and converted in a
+    # pool of that many processes (see getPooledExamples), which needs an
+    # index; one is built if the corpus does not have an up-to-date one.  With
+    # a ConvertCache, converted examples are taken from and added to it, and
+    # it is trimmed to its size limit at the end.  With lazy=True, examples
+    # are LazyExamples, read through the index (which is built if needed)
+    # without the decode pool or the cache.  Examples whose numbers are in
+    # skip (such as those a ProgressJournal has finished) are left out; the
+    # index is built if needed to seek past them.  A binary corpus is read
+    # only with binary=True, since reading one unpickles it; otherwise it is
+    # refused.
+    if isinstance(openFile, str):
+        fileName = openFile
+        openFile = openCorpus(fileName)
+    else:
+        fileName = getattr(openFile, "name", None)
+
+    if binary:
+        for number, example in getBinaryExamples(getattr(openFile, "buffer", openFile), select, skip):
+            yield number, example
+        return
+    if isBinaryCorpus(getattr(openFile, "buffer", openFile)):
+        raise ValueError("%s is a binary corpus, which is only read when asked for explicitly (--binary): loading it unpickles the file" % (fileName or "input"))
+
+    index = None
+    if (select or decodeWorkers > 0 or cache is not None or lazy or skip) and isinstance(fileName, str) and os.path.exists(fileName):
+        if decodeWorkers > 0 or lazy or skip:
+            index = requireIndex(fileName, "lazy trials" if lazy else "the decode pool" if decodeWorkers > 0 else "skipping finished examples")
+        else:
+            index = loadIndex(fileName)
+
+    try:
+        if index is not None:
+            header, entries = index
+            if select:
+                entries = selectEntries(entries, select)
+            if skip:
+                entries = [x for x in entries if x.number not in skip]
+            if lazy:
+                reader = IndexedReader(fileName, header)
+                engines = fileEngines(fileName)
+                for entry in entries:
+                    try:
+                        example = LazyExample(lambda entry=entry: RangeFile(reader, entry.offset, entry.length), entry.trials, engines)
+                    except (ValueError, KeyError) as err:
+                        if isinstance(err, KeyError):
+                            err = "missing %s" % err
+                        sys.stderr.write("skipping malformed example %d at byte %d: %s\n" % (entry.number + 1, entry.offset, err))
+                        continue
+                    yield entry.number, example
+            elif decodeWorkers > 0:
+                for number, example in getPooledExamples(fileName, header, entries, decodeWorkers, readAhead, cache):
+                    yield number, example
+            else:
+                reader = IndexedReader(fileName, header)
+                engines = fileEngines(fileName)
+                for entry in entries:
+                    number, example, error = decodeEntry(entry, reader, cache, engines)
+                    if error is not None:
+                        sys.stderr.write(error + "\n")
+                        continue
+                    yield number, example
+            return
+
+        if select:
+            sys.stderr.write("no up-to-date index for this corpus, scanning all of it (run indexCorpus.py to build one)\n")
+            predicate = selectionPredicate(select)
+
+        scanner = CorpusScanner(openFile)
+        engines = EngineStore(lambda: scanner.header.get("pfa-engines", {}))
+        for entry in scanner.entries():
+            if select and not predicate(entry.number, entry.example.get("function", "") if entry.error is None else ""):
+                continue
+            if skip and entry.number in skip:
+                continue
+            error = entry.error
+            if error is None:
+                try:
+                    engines.resolve(entry.example)
+                except ValueError as err:
+                    error = err
+            if error is not None:
+                sys.stderr.write("skipping malformed example %d at byte %d: %s\n" % (entry.number + 1, entry.offset, error))
+                continue
+            if cache is not None:
+                yield entry.number, cache.convert(indexEntry(entry).hash, entry.example)
+            else:
+                yield entry.number, convertInput(entry.example)
+    finally:
+        if cache is not None:
+            cache.trim()
+
+# A binary corpus (written by convertCorpus.py) stores every example after
+# convertInput, so reading it needs neither JSON parsing nor conversion.  The
+# file is BINARY_MAGIC, a 4-byte length and pickled header, then one record
+# per example: payload length, example number, trial count and function name
+# (binaryRecord), the function name itself and the pickled example.  Records
+# can be skipped by seeking past the payload without unpickling anything.
+# Unpickling can run arbitrary code, so a binary corpus is never detected and
+# loaded on its own: getNumberedExamples reads one only with binary=True (the
+# runners' --binary), and refuses a file that starts with BINARY_MAGIC
+# otherwise.  isBinaryCorpus only looks at the magic.
+
+BINARY_MAGIC = b"PFATESTS\x01"
+binaryRecord = struct.Struct(">IIIH")
+
+def isBinaryCorpus(rawFile):
+    # Python 2 files have seek but no seekable
+    if not getattr(rawFile, "seekable", lambda: hasattr(rawFile, "seek"))():
+        return False
+    start = rawFile.tell()
+    magic = rawFile.read(len(BINARY_MAGIC))
+    rawFile.seek(start)
+    return magic == BINARY_MAGIC
+
+def writeBinaryCorpus(inputFile, outputFile):
+    scanner = CorpusScanner(openCorpus(inputFile))
+    out = open(outputFile, "wb")
+    out.write(BINARY_MAGIC)
+    engines = EngineStore(lambda: scanner.header.get("pfa-engines", {}))
+    headerWritten = False
+    numExamples = 0
+    for entry in scanner.entries():
+        if not headerWritten:
+            header = pickle.dumps(dict(scanner.header, converter=CONVERTER_VERSION), 2)
+            out.write(struct.pack(">I", len(header)) + header)
+            headerWritten = True
+        error = entry.error
+        if error is None:
+            try:
+                engines.resolve(entry.example)
+            except ValueError as err:
+                error = err
+        if error is not None:
+            sys.stderr.write("skipping malformed example %d at byte %d: %s\n" % (entry.number + 1, entry.offset, error))
+            continue
+        example = convertInput(entry.example)
+        function = example["function"].encode("utf-8")
+        payload = pickle.dumps(example, 2)
+        out.write(binaryRecord.pack(len(payload), entry.number, len(example["trials"]), len(function)))
+        out.write(function)
+        out.write(payload)
+        numExamples += 1
+    if not headerWritten:
+        header = pickle.dumps(dict(scanner.header, converter=CONVERTER_VERSION), 2)
+        out.write(struct.pack(">I", len(header)) + header)
+    out.close()
+    return numExamples
+
+def getBinaryExamples(rawFile, select=None, skip=None):
+    if rawFile.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError("not a binary corpus")
+    headerLength, = struct.unpack(">I", rawFile.read(4))
+    header = pickle.loads(rawFile.read(headerLength))
+    if header.get("converter") != CONVERTER_VERSION:
+        raise ValueError("binary corpus was written by converter version %r, this is version %d; rebuild it with convertCorpus.py" % (header.get("converter"), CONVERTER_VERSION))
+
+    predicate = selectionPredicate(select) if select else None
+    while True:
+        head = rawFile.read(binaryRecord.size)
+        if len(head) < binaryRecord.size:
+            break
+        payloadLength, number, trials, functionLength = binaryRecord.unpack(head)
+        function = rawFile.read(functionLength).decode("utf-8")
+        if (predicate is not None and not predicate(number, function)) or (skip and number in skip):
+            rawFile.seek(payloadLength, 1)
+            continue
+        yield number, pickle.loads(rawFile.read(payloadLength))
+
+class CorpusMap(object):
+    # The corpus mapped into memory once.  Worker processes forked after it is
+    # created share its pages: each one reads its assigned examples as
+    # (offset, length) views instead of opening and scanning the whole file,
+    # and no example text is ever sent between processes.
+
+    def __init__(self, inputFile):
+        import mmap
+        self.inputFile = inputFile
+        self.file = open(inputFile, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.bytesRead = 0
+
+    def view(self, offset, length):
+        # the mapped bytes themselves, not a copy; release the view when done,
+        # or the map cannot be closed
+        self.bytesRead += length
+        return memoryview(self.map)[offset:offset + length]
+
+    def text(self, offset, length):
+        # decoded straight from the mapped pages: the only copy is the string
+        # that json.loads needs (Python 2 cannot view an mmap, so it slices)
+        if not nativeBytes:
+            self.bytesRead += length
+            return self.map[offset:offset + length].decode("utf-8")
+        with self.view(offset, length) as view:
+            return codecs.decode(view, "utf-8")
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+def getMappedExamples(corpusMap, entries):
+    engines = fileEngines(corpusMap.inputFile)
+    for entry in entries:
+        try:
+            example = engines.resolve(json.loads(corpusMap.text(entry.offset, entry.length)))
+        except ValueError as err:
+            sys.stderr.write("skipping malformed example %d at byte %d: %s\n" % (entry.number + 1, entry.offset, err))
+            continue
+        yield entry.number, convertInput(example)
+
+def partitionEntries(entries, numParts):
+    # contiguous runs of index entries with roughly equal numbers of bytes
+    total = sum(x.length for x in entries)
+    parts = [[] for i in range(numParts)]
+    seen = 0
+    for x in entries:
+        parts[min(numParts - 1, int(numParts * seen / max(total, 1)))].append(x)
+        seen += x.length
+    return parts
+
+def processStats():
+    import resource
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    return {"pid": os.getpid(), "maxRSS": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+sharedCorpusMap = None   # set by runMapped before forking, inherited by the workers
+
+def runMappedWorker(args):
+    work, entries = args
+    sharedCorpusMap.bytesRead = 0
+    result = work(sharedCorpusMap, entries)
+    stats = processStats()
+    stats["bytesRead"] = sharedCorpusMap.bytesRead
+    stats["examples"] = len(entries)
+    return result, stats
+
+def runMapped(corpusMap, assignments, work):
+    # Calls work(corpusMap, entries) for each list of index entries in its own
+    # forked process and returns [(result, stats), ...] in the same order.
+    # work must be a module-level function so that it can be pickled.
+    global sharedCorpusMap
+    import multiprocessing
+    sharedCorpusMap = corpusMap
+    pool = multiprocessing.get_context("fork").Pool(len(assignments), maxtasksperchild=1)
+    try:
+        return pool.map(runMappedWorker, [(work, x) for x in assignments], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        sharedCorpusMap = None
+
+def getExamples(openFile, select=None, binary=False):
+    for number, example in getNumberedExamples(openFile, select, binary=binary):
+        yield example
+
+# Checkpoints: a ProgressJournal is an append-only text file that records the
+# examples a run has finished, so that an interrupted run can be resumed
+# where it stopped.  It starts with a "# {...}" header naming the corpus (by
+# its index's corpusHash) and the selection, then has one JSON line per
+# finished example with its number, function, trial count, seconds and
+# report lines.  Lines are flushed as the examples are reported, in corpus
+# order, so the finished examples always come first in the selection and
+# replaying their lines before running the rest gives the report of an
+# uninterrupted run.  A line cut short by the interruption is dropped.
+
+JOURNAL_VERSION = 1
+
+def corpusHash(fileName):
+    # the corpusHash of fileName's index, which is built if needed, or the
+    # SHA-1 of a binary corpus, which has no index
+    with open(fileName, "rb") as rawFile:
+        if isBinaryCorpus(rawFile):
+            digest = hashlib.sha1()
+            for block in iter(lambda: rawFile.read(1048576), b""):
+                digest.update(block)
+            return digest.hexdigest()
+    return requireIndex(fileName, "the progress journal")[0]["corpusHash"]
+
+class ProgressJournal(object):
+    def __init__(self, fileName, inputFile, select=None, resume=False):
+        self.fileName = fileName
+        self.header = {"version": JOURNAL_VERSION, "corpusHash": corpusHash(inputFile), "select": select or []}
+        self.records = []
+        if resume and os.path.exists(fileName):
+            self.load()
+            self.out = open(fileName, "a")
+        else:
+            self.out = open(fileName, "w")
+            self.out.write("# " + json.dumps(self.header, sort_keys=True) + "\n")
+            self.out.flush()
+        self.finished = set(x["number"] for x in self.records)
+
+    def load(self):
+        data = open(self.fileName, "rb").read()
+        lines = data.split(b"\n")
+        header = None
+        if lines[0].startswith(b"# "):
+            try:
+                header = json.loads(lines[0][2:].decode("utf-8"))
+            except ValueError:
+                pass
+        if header != self.header:
+            raise ValueError("%s was not written for this corpus and selection (or by this version); remove it or run without --resume" % self.fileName)
+        good = len(lines[0]) + 1
+        for line in lines[1:-1]:
+            try:
+                record = json.loads(line.decode("utf-8"))
+            except ValueError:
+                break
+            self.records.append(record)
+            good += len(line) + 1
+        if good < len(data):
+            # drop whatever follows the last complete record
+            with open(self.fileName, "r+b") as out:
+                out.truncate(good)
+
+    def record(self, number, function, numTrials, seconds, lines):
+        self.out.write(json.dumps({"number": number, "function": function, "trials": numTrials, "seconds": seconds, "lines": lines}, sort_keys=True) + "\n")
+        self.out.flush()
+
+    def close(self):
+        self.out.close()
+
+# Incremental runs: a ResultCache keeps the report lines of every example
+# that ran to the end, one JSON file per example named by the SHA-1 of its
+# text (from the corpus index), in a subdirectory per runner version (which
+# should change whenever the runner's code does).  Nothing is ever deleted,
+# so that checkouts or shards at different versions can share a cache and
+# an unrelated directory cannot lose data; remove the subdirectories of old
+# versions by hand.  Each result also records the fingerprint of the engine
+# implementation it was run with, as a map from names (modules, or a whole
+# package) to hashes of their code, since which modules matter depends on
+# the example: get(contentHash, number, current) only returns the result if
+# current(names) gives the same hashes now.  Reports are renumbered for
+# examples that moved in the corpus.
+
+class ResultCache(object):
+    def __init__(self, directory, runnerVersion):
+        self.directory = directory
+        self.current = os.path.join(directory, runnerVersion)
+        if not os.path.isdir(self.current):
+            os.makedirs(self.current)
+
+    def path(self, contentHash):
+        return os.path.join(self.current, contentHash + ".json")
+
+    def get(self, contentHash, number, current):
+        try:
+            with open(self.path(contentHash)) as cached:
+                result = json.load(cached)
+        except (IOError, OSError, ValueError):
+            return None
+        if result.get("engine") != current(sorted(result.get("engine", {}))):
+            return None
+        if result["number"] != number:
+            old = "%4d    " % (result["number"] + 1)
+            new = "%4d    " % (number + 1)
+            result["lines"] = [new + x[len(old):] if x.startswith(old) else x for x in result["lines"]]
+            result["number"] = number
+        return result
+
+    def put(self, contentHash, number, function, numTrials, seconds, lines, engine):
+        path = self.path(contentHash)
+        temporary = "%s.%d.tmp" % (path, os.getpid())
+        with open(temporary, "w") as out:
+            json.dump({"number": number, "function": function, "trials": numTrials, "seconds": seconds, "lines": lines, "engine": engine}, out, sort_keys=True)
+        os.rename(temporary, path)
+
+class LineRecorder(object):
+    # A stream that passes what is written to it on to stream and keeps it,
+    # so that a runner that prints its report can journal each example's lines
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.written = []
+
+    def write(self, text):
+        self.stream.write(text)
+        self.written.append(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def take(self):
+        # the complete lines written since the last take
+        text = "".join(self.written)
+        end = text.rfind("\n") + 1
+        self.written = [text[end:]] if end < len(text) else []
+        return text[:end].split("\n")[:-1]
+
+# Running trials: runActions calls an engine's action on each of a batch of
+# samples and returns a list of {"success": convert(output)} or
+# {"fail": errorCode(err)} for runtimeError exceptions, in a tight loop, or
+# through batch(samples) if the engine has a batch entry point (a list with an
+# output or a runtimeError for each sample).  Any other exception stops the
+# batch: it is returned, as the (type, value, traceback) of sys.exc_info() so
+# that Python 2 callers can re-raise it with its traceback, with the results
+# of the samples before it.
+# trialBatches splits an example's trials into batches without reading
+# ahead of the one being run, so LazyTrials stay lazy.
+
+ACTION_BATCH = 256
+
+def runActions(action, samples, convert, runtimeError, errorCode, batch=None):
+    results = []
+    append = results.append
+    try:
+        if batch is not None:
+            for output in batch(samples):
+                if isinstance(output, runtimeError):
+                    append({"fail": errorCode(output)})
+                else:
+                    append({"success": convert(output)})
+        else:
+            for sample in samples:
+                try:
+                    append({"success": convert(action(sample))})
+                except runtimeError as err:
+                    append({"fail": errorCode(err)})
+    except Exception:
+        return results, sys.exc_info()
+    return results, None
+
+def trialBatches(trials, size=ACTION_BATCH):
+    batch = []
+    for trial in trials:
+        batch.append(trial)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+# compare(expected, actual, ...) yields a message for each difference beyond
+# tolerance, naming the path to it.  Nearly every result matches, so it first
+# asks agrees, which walks both values without building paths or messages and
+# returns True exactly when differences would yield nothing; differences then
+# only descends into the subtrees that disagree.
+
+def agrees(one, two, zeroTolerance, fractionalTolerance, infinityTolerance):
+    if one == two:
+        return True
+    elif isinstance(one, dict) and isinstance(two, dict):
+        if len(one) != len(two):
+            return False
+        for k, v in one.items():
+            if k not in two or not agrees(v, two[k], zeroTolerance, fractionalTolerance, infinityTolerance):
+                return False
+        return True
+    elif isinstance(one, list) and isinstance(two, list):
+        if len(one) != len(two):
+            return False
+        if len(one) >= VECTOR_THRESHOLD or (len(one) > 0 and isinstance(one[0], list) and len(one) * len(one[0]) >= VECTOR_THRESHOLD):
+            result = vectorAgrees(one, two, zeroTolerance, fractionalTolerance, infinityTolerance)
+            if result is not None:
+                return result
+        for i in range(len(one)):
+            if not agrees(one[i], two[i], zeroTolerance, fractionalTolerance, infinityTolerance):
+                return False
+        return True
+    elif isinstance(one, (int, float)) and isinstance(two, (int, float)):
+        if isinstance(one, int) and isinstance(two, int):
+            return False
+        elif abs(one) < zeroTolerance and abs(two) < zeroTolerance:
+            return True
+        elif abs(one) < zeroTolerance or abs(two) < zeroTolerance:
+            return False
+        else:
+            return not abs(one - two)/abs(one) > fractionalTolerance
+    elif one == "inf":
+        return isinstance(two, (int, float)) and two > infinityTolerance
+    elif one == "-inf":
+        return isinstance(two, (int, float)) and two < -infinityTolerance
+    elif two == "inf":
+        return isinstance(one, (int, float)) and one > infinityTolerance
+    elif two == "-inf":
+        return isinstance(one, (int, float)) and one < -infinityTolerance
+    else:
+        return False
+
+# Large numeric arrays and matrices: agrees checks a list of at least
+# VECTOR_THRESHOLD numbers and "inf"/"-inf"/"nan" strings, or a rectangular
+# list of such lists, with NumPy, applying the rules of the scalar path to
+# every pair of elements at once.  vectorAgrees returns None, leaving the
+# values to the scalar path, if NumPy is not installed, the values are not of
+# that form, or an integer is too large to be exactly a double.  A list of
+# strings alone (such as the keys of a map) is not of that form, even if they
+# are all sentinels, and NumPy is only imported once the values are.  A list
+# that disagrees is reported by differences element by element as before.
+
+VECTOR_THRESHOLD = 128
+vectorSentinels = ("inf", "-inf", "nan")
+
+def numericValues(x):
+    # (shape of x, flat list of its elements, set of their types)
+    if isinstance(x[0], list):
+        shape = (len(x), len(x[0]))
+        if not all(isinstance(row, list) and len(row) == shape[1] for row in x):
+            return None
+        x = [v for row in x for v in row]
+    else:
+        shape = (len(x),)
+    kinds = set(map(type, x))
+    # strings alone are not numbers, only sentinels among numbers
+    if not kinds <= set([int, float, bool, str]) or kinds == set([str]):
+        return None
+    return shape, x, kinds
+
+def numericColumn(numpy, values, kinds):
+    # (doubles, which are integers, which sentinel: 0 for none or 1 + its
+    # index in vectorSentinels)
+    if str in kinds:
+        objects = numpy.array(values, dtype=object)
+        sentinel = numpy.zeros(len(values), dtype=numpy.int8)
+        for i, name in enumerate(vectorSentinels):
+            sentinel[objects == name] = i + 1
+        isString = numpy.fromiter((type(v) is str for v in values), dtype=bool, count=len(values))
+        if (isString & (sentinel == 0)).any():
+            return None
+        objects[isString] = 0.0
+        values = objects
+    else:
+        sentinel = numpy.zeros(len(values), dtype=numpy.int8)
+    try:
+        doubles = numpy.array(values, dtype=numpy.float64)
+    except OverflowError:
+        return None
+    if int in kinds or bool in kinds:
+        integers = numpy.fromiter((type(v) is int or type(v) is bool for v in values), dtype=bool, count=len(values))
+        if (numpy.abs(doubles[integers]) >= 2**53).any():
+            return None
+    else:
+        integers = numpy.zeros(len(values), dtype=bool)
+    return doubles, integers, sentinel
+
+def vectorAgrees(one, two, zeroTolerance, fractionalTolerance, infinityTolerance):
+    x = numericValues(one)
+    y = numericValues(two)
+    if x is None or y is None or x[0] != y[0] or len(x[1]) < VECTOR_THRESHOLD:
+        return None
+    try:
+        import numpy
+    except ImportError:
+        return None
+    x = numericColumn(numpy, x[1], x[2])
+    y = numericColumn(numpy, y[1], y[2])
+    if x is None or y is None:
+        return None
+    a, aInt, aSentinel = x
+    b, bInt, bSentinel = y
+
+    with numpy.errstate(all="ignore"):
+        aZero = numpy.abs(a) < zeroTolerance
+        bZero = numpy.abs(b) < zeroTolerance
+        close = (a == b) | (aZero & bZero) | (~aZero & ~bZero & ~(numpy.abs(a - b)/numpy.abs(a) > fractionalTolerance))
+        numbers = numpy.where(aInt & bInt, a == b, close)
+        aInfinite = numpy.where(aSentinel == 1, b > infinityTolerance, (aSentinel == 2) & (b < -infinityTolerance))
+        bInfinite = numpy.where(bSentinel == 1, a > infinityTolerance, (bSentinel == 2) & (a < -infinityTolerance))
+        sentinels = numpy.where(bSentinel == 0, aInfinite, numpy.where(aSentinel == 0, bInfinite, aSentinel == bSentinel))
+        return bool(numpy.where((aSentinel == 0) & (bSentinel == 0), numbers, sentinels).all())
 
 def compare(one, two, zeroTolerance, fractionalTolerance, infinityTolerance, breadcrumbs=None):
     if breadcrumbs is None:
         breadcrumbs = ["top"]
+    if agrees(one, two, zeroTolerance, fractionalTolerance, infinityTolerance):
+        return iter(())
+    return differences(one, two, zeroTolerance, fractionalTolerance, infinityTolerance, breadcrumbs)
+
+def differences(one, two, zeroTolerance, fractionalTolerance, infinityTolerance, breadcrumbs):
     if isinstance(one, dict) and isinstance(two, dict):
         if set(one.keys()) != set(two.keys()):
             yield "different dict keys: {%s} vs {%s} at %s" % (", ".join(sorted(one.keys())), ", ".join(sorted(two.keys())), " -> ".join(breadcrumbs))
         else:
             for k in sorted(one.keys()):
-                for x in compare(one[k], two[k], zeroTolerance, fractionalTolerance, infinityTolerance, breadcrumbs + [k]):
-                    yield x
+                if not agrees(one[k], two[k], zeroTolerance, fractionalTolerance, infinityTolerance):
+                    for x in differences(one[k], two[k], zeroTolerance, fractionalTolerance, infinityTolerance, breadcrumbs + [k]):
+                        yield x
     elif isinstance(one, list) and isinstance(two, list):
         if len(one) != len(two):
             yield "different list lengths: %d vs %d at %s" % (len(one), len(two), " -> ".join(breadcrumbs))
         else:
             for i in range(len(one)):
-                for x in compare(one[i], two[i], zeroTolerance, fractionalTolerance, infinityTolerance, breadcrumbs + [str(i)]):
-                    yield x
-    elif isinstance(one, str) and isinstance(two, str):
+                if not agrees(one[i], two[i], zeroTolerance, fractionalTolerance, infinityTolerance):
+                    for x in differences(one[i], two[i], zeroTolerance, fractionalTolerance, infinityTolerance, breadcrumbs + [str(i)]):
+                        yield x
+    elif isinstance(one, stringTypes) and isinstance(two, stringTypes):
         if one != two:
             yield "different values: %s vs %s at %s" % (json.dumps(one), json.dumps(two), " -> ".join(breadcrumbs))
     elif isinstance(one, bool) and isinstance(two, bool):
@@ -317,6 +2370,114 @@ def compare(one, two, zeroTolerance, fractionalTolerance, infinityTolerance, bre
     else:
         yield "different types: %s vs %s at %s" % (type(one).__name__, type(two).__name__, " -> ".join(breadcrumbs))
 
+# compareUnordered is compare for "unordered" nondeterministic results: lists
+# that must have the same elements in any order.  Elements are first matched
+# exactly by counting their unorderedKeys: strings and numbers as themselves,
+# maps of them as sets of items, and everything else by its canonical JSON
+# (sorted keys, so dicts need not be sortable).  The few left over, such as
+# numbers that differ within tolerance or NaNs, are sorted (by
+# unorderedSortKey, which orders any JSON value and puts NaN after the
+# numbers) and paired up in that order where they agree; anything still
+# unmatched is tried against every remaining actual element before it is
+# reported.
+
+unorderedScalars = set((int, float, bool) + stringTypes)
+
+def unorderedKey(x):
+    if isinstance(x, stringTypes + (int, float)):
+        return x
+    if isinstance(x, dict):
+        try:
+            return frozenset(x.items())
+        except TypeError:
+            pass
+    return (json.dumps(x, sort_keys=True),)
+
+def unorderedKeys(values):
+    if set(map(type, values)) <= unorderedScalars:
+        return values
+    else:
+        return [unorderedKey(x) for x in values]
+
+def unorderedSortKey(x):
+    if x is None:
+        return (0,)
+    elif isinstance(x, (int, float)):
+        if x == x:
+            return (1, x)
+        else:
+            return (2,)
+    elif x == "inf" or x == "-inf":
+        return (1, float(x))
+    elif x == "nan":
+        return (2,)
+    elif isinstance(x, stringTypes):
+        return (3, x)
+    elif isinstance(x, list):
+        return (4, tuple(unorderedSortKey(v) for v in x))
+    elif isinstance(x, dict):
+        return (5, tuple(sorted((k, unorderedSortKey(v)) for k, v in x.items())))
+    else:
+        return (6, json.dumps(x, sort_keys=True))
+
+def sortedElements(values):
+    # directly if they are all strings or all numbers other than NaN, which
+    # is much faster than with a key
+    kinds = set(map(type, values))
+    if kinds <= set([str]) or (kinds <= set([int, float, bool]) and all(x == x for x in values)):
+        return sorted(values)
+    else:
+        return sorted(values, key=unorderedSortKey)
+
+def unmatchedElements(values, keys, extra):
+    out = []
+    for x, key in zip(values, keys):
+        if extra[key] > 0:
+            extra[key] -= 1
+            out.append(x)
+    return out
+
+def compareUnordered(one, two, zeroTolerance, fractionalTolerance, infinityTolerance, breadcrumbs=None):
+    if breadcrumbs is None:
+        breadcrumbs = ["top"]
+    if not isinstance(one, list) or not isinstance(two, list) or len(one) != len(two):
+        for x in compare(one, two, zeroTolerance, fractionalTolerance, infinityTolerance, breadcrumbs):
+            yield x
+        return
+    if agrees(one, two, zeroTolerance, fractionalTolerance, infinityTolerance):
+        return
+
+    oneKeys = unorderedKeys(one)
+    twoKeys = unorderedKeys(two)
+    oneCounts = Counter(oneKeys)
+    twoCounts = Counter(twoKeys)
+    if dict.__eq__(oneCounts, twoCounts):
+        return
+    if set(oneCounts).isdisjoint(twoCounts):
+        expected = list(one)
+        actual = list(two)
+    else:
+        expected = unmatchedElements(one, oneKeys, oneCounts - twoCounts)
+        actual = unmatchedElements(two, twoKeys, twoCounts - oneCounts)
+    expected = sortedElements(expected)
+    actual = sortedElements(actual)
+    if agrees(expected, actual, zeroTolerance, fractionalTolerance, infinityTolerance):
+        return
+
+    paired = [agrees(x, y, zeroTolerance, fractionalTolerance, infinityTolerance) for x, y in zip(expected, actual)]
+    expected = [x for x, same in zip(expected, paired) if not same]
+    actual = [y for y, same in zip(actual, paired) if not same]
+    unmatched = []
+    for x in expected:
+        for i, y in enumerate(actual):
+            if agrees(x, y, zeroTolerance, fractionalTolerance, infinityTolerance):
+                del actual[i]
+                break
+        else:
+            unmatched.append(x)
+    if len(unmatched) > 0:
+        yield "different elements: %s vs %s at %s" % (json.dumps(unmatched), json.dumps(actual), " -> ".join(breadcrumbs))
+
 if __name__ == "__main__":
     for example in getExamples(open("pfa-tests.json")):
         print(json.dumps(example["engine"]))
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 
+import argparse
 import json
+import os
 import signal
 import sys
 import re
+import time
 
 from runTest import *
 
@@ -16,14 +19,33 @@ if __name__ == "__main__":
     pef = PFAEngineFactory()
     pef.setDebug(False)
 
-    if len(sys.argv[1:]) == 1:
-        inputFile, = sys.argv[1:]
-        outputFile = None
-    else:
-        inputFile, outputFile = sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Run the PFA conformance tests against Hadrian, or fill in a test template.")
+    parser.add_argument("inputFile", help="pfa-tests.json or a template with UNKNOWN_ results")
+    parser.add_argument("outputFile", nargs="?", help="where to write the filled-in template")
+    parser.add_argument("--select", action="append", metavar="PATTERN", help="only run examples whose function matches a glob (\"prob.dist.*QF\") or namespace (\"prob.dist\"), or whose number is in a range (\"100-200\"); may be repeated")
+    parser.add_argument("--binary", action="store_true", help="inputFile is a binary corpus written by convertCorpus.py; it is unpickled, so only use this on files you built yourself")
+    parser.add_argument("--journal", metavar="FILE", help="record every finished example and its report in FILE as the run goes, so that an interrupted run can be resumed")
+    parser.add_argument("--resume", action="store_true", help="with --journal, report the examples that FILE says are finished from it and run only the rest")
+    args = parser.parse_args()
+    if args.resume and args.journal is None:
+        parser.error("--resume needs the --journal of the interrupted run")
+    if args.journal is not None and args.outputFile is not None:
+        parser.error("--journal cannot be used when filling in a template")
+    if args.binary and args.outputFile is not None:
+        parser.error("--binary cannot be used when filling in a template")
+    if os.path.isfile(args.inputFile):
+        with open(args.inputFile, "rb") as rawFile:
+            binary = isBinaryCorpus(rawFile)
+        if binary and not args.binary:
+            parser.error("%s is a binary corpus; pass --binary to read it (only for files you built yourself)" % args.inputFile)
+        if args.binary and not binary:
+            parser.error("%s is not a binary corpus written by convertCorpus.py" % args.inputFile)
+
+    inputFile = args.inputFile
+    outputFile = args.outputFile
 
     if outputFile is not None:
-        template = dict(enumerate(open(inputFile).readlines()))
+        template = dict(enumerate(openCorpus(inputFile).readlines()))
         lookup = {}
         numFunctions = 0
         for lineNumber, lineContent in template.items():
@@ -37,7 +59,22 @@ if __name__ == "__main__":
         lookup = None
         numFunctions = None
 
-    for counter, example in enumerate(getExamples(open(inputFile))):
+    # the report is printed, so with a journal each example's lines are
+    # picked up from stdout as it is written
+    journal = None
+    if args.journal is not None:
+        try:
+            journal = ProgressJournal(args.journal, inputFile, args.select, args.resume)
+        except ValueError as err:
+            parser.error(str(err))
+        for record in journal.records:
+            for line in record["lines"]:
+                print line
+        recorder = LineRecorder(sys.stdout)
+        sys.stdout = recorder
+
+    for counter, example in getNumberedExamples(inputFile, args.select, skip=None if journal is None else journal.finished, binary=args.binary):
+        exampleStart = time.time()
         engine = pef.engineFromJson(json.dumps(example["engine"]))
 
         if numFunctions is not None:
@@ -49,48 +86,65 @@ if __name__ == "__main__":
                 print "%4d    %-20s%s" % (counter + 1, example["function"], json.dumps(example["engine"]))
             return True
 
-        for trial in example["trials"]:
-            trialWritten = False
-            try:
-                result = {"success": convertOut(pef.action(engine, trial["sample"]), json.loads(engine.outputType().toString()), dobase64=False)}
-            except PFARuntimeException as err:
-                result = {"fail": err.code()}
-
-            if "success" in result:
-                actual = json.dumps(result["success"])
-            else:
-                actual = "ERROR CODE " + str(result["fail"])
-
-            def maybeWriteTrial(trialWritten):
-                if not trialWritten:
-                    print "                            input:    " + json.dumps(trial["sample"])
-                    print "                            expected: " + json.dumps(trial["result"])
-                    print "                            actual:   " + actual
-                return True
-
-            if "error" in trial:
-                if trial["error"] != result.get("fail", None):
-                    functionWritten = maybeWriteFunction(functionWritten)
+        outputType = json.loads(engine.outputType().toString())
+        for trials in trialBatches(example["trials"]):
+            results, failure = runActions(lambda sample: pef.action(engine, sample), [x["sample"] for x in trials], lambda x: convertOut(x, outputType, dobase64=False), PFARuntimeException, lambda err: err.code(), getattr(engine, "actionBatch", None))
+            for trial, result in zip(trials, results):
+                trialWritten = False
+
+                if "success" in result:
+                    actual = json.dumps(result["success"])
+                else:
+                    actual = "ERROR CODE " + str(result["fail"])
+
+                def maybeWriteTrial(trialWritten):
                     if not trialWritten:
                         print "                            input:    " + json.dumps(trial["sample"])
-                        print "                            expected: ERROR CODE " + str(trial["error"])
+                        print "                            expected: " + json.dumps(trial["result"])
                         print "                            actual:   " + actual
-                        trialWritten = True
-
-            elif trial.get("nondeterministic", None) is not None:
-                if outputFile is not None and trial["result"].startswith("UNKNOWN_"):
-                    lineNumber = lookup[trial["result"]]
-                    if "success" in result:
-                        if trial["nondeterministic"] == "pseudorandom":
-                            template[lineNumber] = template[lineNumber].replace(', "result": "' + trial["result"] + '"', "")
+                    return True
+
+                if "error" in trial:
+                    if trial["error"] != result.get("fail", None):
+                        functionWritten = maybeWriteFunction(functionWritten)
+                        if not trialWritten:
+                            print "                            input:    " + json.dumps(trial["sample"])
+                            print "                            expected: ERROR CODE " + str(trial["error"])
+                            print "                            actual:   " + actual
+                            trialWritten = True
+
+                elif trial.get("nondeterministic", None) is not None:
+                    if outputFile is not None and trial["result"].startswith("UNKNOWN_"):
+                        lineNumber = lookup[trial["result"]]
+                        if "success" in result:
+                            if trial["nondeterministic"] == "pseudorandom":
+                                template[lineNumber] = template[lineNumber].replace(', "result": "' + trial["result"] + '"', "")
+                            else:
+                                template[lineNumber] = template[lineNumber].replace('"result": "' + trial["result"] + '"', '"result": ' + json.dumps(result["success"]))
                         else:
-                            template[lineNumber] = template[lineNumber].replace('"result": "' + trial["result"] + '"', '"result": ' + json.dumps(result["success"]))
+                            template[lineNumber] = template[lineNumber].replace('"result": "' + trial["result"] + '", "nondeterministic": "' + trial["nondeterministic"] + '"', '"error": ' + json.dumps(result["fail"]))
                     else:
-                        template[lineNumber] = template[lineNumber].replace('"result": "' + trial["result"] + '", "nondeterministic": "' + trial["nondeterministic"] + '"', '"error": ' + json.dumps(result["fail"]))
+                        if trial["nondeterministic"] == "unordered":
+                            if "success" in result:
+                                for errorMessage in compareUnordered(trial["result"], result["success"], 1e-8, 0.01, 1e80):
+                                    functionWritten = maybeWriteFunction(functionWritten)
+                                    trialWritten = maybeWriteTrial(trialWritten)
+                                    print "                                " + errorMessage
+                            else:
+                                functionWritten = maybeWriteFunction(functionWritten)
+                                trialWritten = maybeWriteTrial(trialWritten)
+                                print "                                " + errorMessage
+
                 else:
-                    if trial["nondeterministic"] == "unordered":
+                    if outputFile is not None and trial["result"].startswith("UNKNOWN_"):
+                        lineNumber = lookup[trial["result"]]
                         if "success" in result:
-                            for errorMessage in compare(sorted(trial["result"]), sorted(result["success"]), 1e-8, 0.01, 1e80):
+                            template[lineNumber] = template[lineNumber].replace('"result": "' + trial["result"] + '"', '"result": ' + json.dumps(result["success"]))
+                        else:
+                            template[lineNumber] = template[lineNumber].replace('"result": "' + trial["result"] + '"', '"error": ' + json.dumps(result["fail"]))
+                    else:
+                        if "success" in result:
+                            for errorMessage in compare(trial["result"], result["success"], 1e-8, 0.01, 1e80):
                                 functionWritten = maybeWriteFunction(functionWritten)
                                 trialWritten = maybeWriteTrial(trialWritten)
                                 print "                                " + errorMessage
@@ -99,29 +153,22 @@ if __name__ == "__main__":
                             trialWritten = maybeWriteTrial(trialWritten)
                             print "                                " + errorMessage
 
-            else:
-                if outputFile is not None and trial["result"].startswith("UNKNOWN_"):
-                    lineNumber = lookup[trial["result"]]
-                    if "success" in result:
-                        template[lineNumber] = template[lineNumber].replace('"result": "' + trial["result"] + '"', '"result": ' + json.dumps(result["success"]))
-                    else:
-                        template[lineNumber] = template[lineNumber].replace('"result": "' + trial["result"] + '"', '"error": ' + json.dumps(result["fail"]))
-                else:
-                    if "success" in result:
-                        for errorMessage in compare(trial["result"], result["success"], 1e-8, 0.01, 1e80):
-                            functionWritten = maybeWriteFunction(functionWritten)
-                            trialWritten = maybeWriteTrial(trialWritten)
-                            print "                                " + errorMessage
-                    else:
-                        functionWritten = maybeWriteFunction(functionWritten)
-                        trialWritten = maybeWriteTrial(trialWritten)
-                        print "                                " + errorMessage
+            if failure is not None:
+                raise failure[0], failure[1], failure[2]
 
         if outputFile is None and not functionWritten:
             print "%4d    %s" % (counter + 1, example["function"])
 
+        if journal is not None:
+            journal.record(counter, example["function"], len(example["trials"]), time.time() - exampleStart, recorder.take())
+
+    if journal is not None:
+        journal.close()
+
     if outputFile is not None:
-        out = open(outputFile, "w")
+        out = ChunkedWriter(outputFile)
         for lineNumber in xrange(len(template)):
+            if template[lineNumber].startswith('     {"function":'):
+                out.exampleBoundary()
             out.write(template[lineNumber])
         out.close()
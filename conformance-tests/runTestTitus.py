@@ -1,14 +1,357 @@
 #!/usr/bin/env python
 
+import argparse
+import ast
+import hashlib
 import json
+import marshal
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import random
 import sys
+import time
+import traceback
+from collections import deque, OrderedDict
 
+import titus.datatype
+import titus.genpy
+import titus.options
+import titus.pfaast
+import titus.reader
+import titus.signature
+import titus.util
+import titus.version
 from titus.genpy import PFAEngine
 from titus.errors import PFARuntimeException
 
-from runTest import getExamples, convertOut, compare
+import runTest
+from runTest import getNumberedExamples, ConvertCache, ProgressJournal, ResultCache, compileOutputConverter, compare, compareUnordered, engineHash, isBinaryCorpus, requireIndex, runActions, selectEntries, trialBatches
 
-inputFile = sys.argv[1]
+# Compiled engines: PFAEngine.fromJson parses the engine, type-checks it,
+# generates Python for it and compiles that, then makes an instance.
+# EngineCache does the first steps once per distinct engine (by the hash of
+# its canonical JSON) and keeps the parsed engine and generated class for the
+# most recently used maxEntries engines, so that each example still gets a
+# fresh instance with its own cells, pools and random state.  With a
+# directory, the compiled Python is also stored there, by Titus version and
+# Python bytecode version, and later runs only parse the engine (Titus's
+# syntax trees cannot be pickled) and skip type checking, code generation and
+# compiling: the stored code was generated from the same canonical JSON by
+# the same Titus, so it has passed type checking already.
+#
+# Titus has no public way to make an instance from a compiled class, so
+# engineSandbox, engineClass and instantiateEngine copy the inside of
+# PFAEngine.fromAst as of the Titus versions in copiedTitusVersions.  With any
+# other version, EngineCache makes every engine with PFAEngine.fromJson and
+# caches nothing.
+
+copiedTitusVersions = ("1.2.0",)
+
+engineSandbox = dict((name, getattr(titus.genpy, name)) for name in ("PFAEngine", "ExecutionState", "DynamicScope", "labeledFcn", "get", "update", "do", "ifThen", "ifThenElse", "cond", "condElse", "doWhile", "doUntil", "doFor", "doForeach", "doForkeyval", "cast", "wrapAsUnion", "ifNotNull", "ifNotNullElse", "pack", "unpack", "unpackElse", "error", "tryCatch"))
+engineSandbox.update({"call": titus.util.callfcn, "checkData": titus.datatype.checkData, "math": math})
+
+class EngineCache(object):
+    def __init__(self, maxEntries, directory=None):
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()   # key -> (engineConfig, class, compile seconds)
+        self.directory = None
+        if directory is not None:
+            self.directory = os.path.join(directory, "titus-%s-%s" % (titus.version.titusVersion, sys.implementation.cache_tag))
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.compileSeconds = 0.0
+        self.savedSeconds = 0.0
+
+    def counts(self):
+        return (self.hits, self.diskHits, self.misses, self.compileSeconds, self.savedSeconds)
+
+    def add(self, counts):
+        self.hits += counts[0]
+        self.diskHits += counts[1]
+        self.misses += counts[2]
+        self.compileSeconds += counts[3]
+        self.savedSeconds += counts[4]
+
+    def engine(self, engineJson, key=None):
+        # a new instance of engineJson, whose engineHash may be given as key
+        start = time.time()
+        if titus.version.titusVersion not in copiedTitusVersions:
+            out = PFAEngine.fromJson(engineJson)[0]
+            self.misses += 1
+            self.compileSeconds += time.time() - start
+            return out
+        if key is None:
+            key = engineHash(engineJson)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        else:
+            entry = self.load(key, engineJson)
+            if entry is not None:
+                self.diskHits += 1
+
+        if entry is not None:
+            engineConfig, cls, seconds = entry
+            out = instantiateEngine(engineConfig, cls)
+            self.savedSeconds += seconds - (time.time() - start)
+        else:
+            engineConfig, cls, code = compileEngine(engineJson)
+            out = instantiateEngine(engineConfig, cls)
+            seconds = time.time() - start
+            self.misses += 1
+            self.compileSeconds += seconds
+            self.store(key, code, seconds)
+
+        self.entries[key] = (engineConfig, cls, seconds)
+        if len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+        return out
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".marshal")
+
+    def load(self, key, engineJson):
+        # (engineConfig, class, seconds it took to compile) from the directory
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key), "rb") as stored:
+                seconds, code = marshal.load(stored)
+            os.utime(self.path(key), None)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        engineConfig = titus.reader.jsonToAst(engineJson)
+        return engineConfig, engineClass(code, engineConfig.inputPlaceholder.parser), seconds
+
+    def store(self, key, code, seconds):
+        if self.directory is not None:
+            temporary = "%s.%d.tmp" % (self.path(key), os.getpid())
+            with open(temporary, "wb") as out:
+                marshal.dump((seconds, code), out)
+            os.rename(temporary, self.path(key))
+
+def compileEngine(engineJson):
+    # PFAEngine.fromJson up to the instance: (engineConfig, class, code)
+    engineConfig = titus.reader.jsonToAst(engineJson)
+    engineOptions = titus.options.EngineOptions(engineConfig.options, None)
+    pfaVersion = titus.signature.PFAVersion.fromString(titus.version.defaultPFAVersion)
+    context, code = engineConfig.walk(titus.genpy.GeneratePython.makeTask("pure"), titus.pfaast.SymbolTable.blank(), titus.pfaast.FunctionTable.blank(), engineOptions, pfaVersion)
+    code = compile(code, "<string>", "exec")
+    return engineConfig, engineClass(code, context.parser), code
+
+def engineClass(code, parser):
+    sandbox = dict(engineSandbox)
+    exec(code, sandbox)
+    cls = [x for x in sandbox.values() if getattr(x, "__bases__", None) == (PFAEngine,)][0]
+    cls.parser = parser
+    return cls
+
+def instantiateEngine(engineConfig, cls):
+    # the rest of PFAEngine.fromAst with sharedState=None and multiplicity=1:
+    # shared cells and pools live in a SharedState of this instance's own
+    sharedState = titus.genpy.SharedState()
+    for cellName, cellConfig in engineConfig.cells.items():
+        if cellConfig.shared:
+            value = titus.datatype.jsonDecoder(cellConfig.avroType, cellConfig.initJsonNode)
+            sharedState.cells[cellName] = titus.genpy.Cell(value, cellConfig.shared, cellConfig.rollback, cellConfig.source)
+    for poolName, poolConfig in engineConfig.pools.items():
+        if poolConfig.shared:
+            value = titus.datatype.jsonDecoder(titus.datatype.AvroMap(poolConfig.avroType), poolConfig.initJsonNode)
+            sharedState.pools[poolName] = titus.genpy.Pool(value, poolConfig.shared, poolConfig.rollback, poolConfig.source)
+
+    cells = dict(sharedState.cells)
+    for cellName, cellConfig in engineConfig.cells.items():
+        if not cellConfig.shared:
+            value = titus.datatype.jsonDecoder(cellConfig.avroType, cellConfig.initJsonNode)
+            cells[cellName] = titus.genpy.Cell(value, cellConfig.shared, cellConfig.rollback, cellConfig.source)
+    pools = dict(sharedState.pools)
+    for poolName, poolConfig in engineConfig.pools.items():
+        if not poolConfig.shared:
+            value = titus.datatype.jsonDecoder(titus.datatype.AvroMap(poolConfig.avroType), poolConfig.initJsonNode)
+            pools[poolName] = titus.genpy.Pool(value, poolConfig.shared, poolConfig.rollback, poolConfig.source)
+    if engineConfig.method == titus.genpy.Method.FOLD:
+        zero = titus.datatype.jsonDecoder(engineConfig.output, json.loads(engineConfig.zero))
+    else:
+        zero = None
+    if engineConfig.randseed is None:
+        rand = random.Random()
+    else:
+        rand = random.Random(engineConfig.randseed)
+
+    engine = cls(cells, pools, engineConfig, titus.options.EngineOptions(engineConfig.options, None), titus.genpy.genericLog, titus.genpy.genericEmit, zero, 0, rand)
+    f = dict(titus.pfaast.FunctionTable.blank().functions)
+    if engineConfig.method == titus.genpy.Method.EMIT:
+        f["emit"] = titus.genpy.FakeEmitForExecution(engine)
+    engine.f = f
+    engine.config = engineConfig
+    titus.genpy.checkForDeadlock(engineConfig, engine)
+    engine.initialize()
+    return engine
+
+# Engine fingerprints for --result-cache: what a cached report depends on in
+# Titus.  At "package" granularity that is every Python file of the titus
+# package, so any change re-runs everything.  At "module" granularity it is
+# the core modules that parse, check and run engines (with the modules they
+# import, except the function library) plus the library modules that define
+# the functions an engine calls (with the modules they import), so that a
+# change to titus/lib/prob/dist.py only re-runs the examples that use it.
+
+coreModules = ("titus.datatype", "titus.errors", "titus.genpy", "titus.options", "titus.pfaast", "titus.reader", "titus.signature", "titus.util", "titus.version")
+
+class EngineFingerprint(object):
+    def __init__(self, granularity):
+        self.granularity = granularity
+        self.root = os.path.dirname(os.path.abspath(titus.__file__))
+        self.hashes = {}      # module name or "titus" -> SHA-1 of its code
+        self.closures = {}    # frozenset of library modules -> fingerprint
+        self.functions = titus.pfaast.FunctionTable.blank().functions
+        self.core = self.closure(coreModules, "titus.lib.")
+
+    def moduleFile(self, name):
+        # the source file of a titus module, or None if it is not one
+        path = os.path.join(self.root, *name.split(".")[1:])
+        for fileName in (path + ".py", os.path.join(path, "__init__.py")):
+            if os.path.isfile(fileName):
+                return fileName
+        return None
+
+    def hash(self, name):
+        if name not in self.hashes:
+            digest = hashlib.sha1()
+            if name == "titus":
+                for directory, subdirectories, fileNames in sorted(os.walk(self.root)):
+                    subdirectories.sort()
+                    for fileName in sorted(fileNames):
+                        if fileName.endswith(".py"):
+                            path = os.path.join(directory, fileName)
+                            digest.update(os.path.relpath(path, self.root).encode("utf-8") + b"\0")
+                            with open(path, "rb") as source:
+                                digest.update(source.read())
+                self.hashes[name] = digest.hexdigest()
+            else:
+                fileName = self.moduleFile(name)
+                if fileName is None:
+                    self.hashes[name] = None
+                else:
+                    with open(fileName, "rb") as source:
+                        digest.update(source.read())
+                    self.hashes[name] = digest.hexdigest()
+        return self.hashes[name]
+
+    def imports(self, name):
+        # the titus modules that module name imports, anywhere in its code
+        with open(self.moduleFile(name), "rb") as source:
+            tree = ast.parse(source.read())
+        out = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                candidates = [x.name for x in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module is not None and node.level == 0:
+                candidates = [node.module + "." + x.name for x in node.names] + [node.module]
+            else:
+                continue
+            for candidate in candidates:
+                if (candidate == "titus" or candidate.startswith("titus.")) and self.moduleFile(candidate) is not None:
+                    out.add(candidate)
+        return out
+
+    def closure(self, modules, stop=None):
+        # modules and those they import, not following imports into names
+        # that start with stop
+        out = set()
+        todo = list(modules)
+        while todo:
+            name = todo.pop()
+            if name not in out:
+                out.add(name)
+                todo.extend(x for x in self.imports(name) if stop is None or not x.startswith(stop))
+        return out
+
+    def current(self, names):
+        # the fingerprint of names as the code is now; at package granularity,
+        # results fingerprinted by module are not trusted
+        if self.granularity == "package" and names != ["titus"]:
+            return None
+        return dict((name, self.hash(name)) for name in names)
+
+    def calledModules(self, engineJson):
+        out = set()
+        todo = [engineJson]
+        while todo:
+            x = todo.pop()
+            if isinstance(x, dict):
+                for key, value in x.items():
+                    if key in self.functions:
+                        out.add(type(self.functions[key]).__module__)
+                    todo.append(value)
+            elif isinstance(x, list):
+                todo.extend(x)
+            elif isinstance(x, str) and x in self.functions:
+                out.add(type(self.functions[x]).__module__)
+        return frozenset(out)
+
+    def engine(self, engineJson):
+        # the fingerprint of what an example with this engine depends on
+        if self.granularity == "package":
+            return self.current(["titus"])
+        modules = self.calledModules(engineJson)
+        if modules not in self.closures:
+            self.closures[modules] = self.current(self.core.union(self.closure(modules)))
+        return self.closures[modules]
+
+def runnerVersion():
+    # changes with this runner, runTest.py or the Python it runs on
+    digest = hashlib.sha1()
+    for fileName in (__file__, runTest.__file__):
+        with open(fileName, "rb") as source:
+            digest.update(source.read())
+    return "%s-%s" % (sys.implementation.cache_tag, digest.hexdigest()[:16])
+
+parser = argparse.ArgumentParser(description="Run the PFA conformance tests against Titus.")
+parser.add_argument("inputFile", help="pfa-tests.json or another corpus in the same format")
+parser.add_argument("--select", action="append", metavar="PATTERN", help="only run examples whose function matches a glob (\"prob.dist.*QF\") or namespace (\"prob.dist\"), or whose number is in a range (\"100-200\"); may be repeated")
+parser.add_argument("--binary", action="store_true", help="inputFile is a binary corpus written by convertCorpus.py; it is unpickled, so only use this on files you built yourself")
+parser.add_argument("--decode-workers", type=int, default=0, metavar="N", help="parse and convert examples in N worker processes, which share one memory map of an uncompressed corpus (uses the corpus index, building it if needed)")
+parser.add_argument("--read-ahead", type=int, default=64, metavar="N", help="with --decode-workers or --jobs, how many examples may be decoded ahead of the one being reported (default 64)")
+parser.add_argument("--convert-cache", metavar="DIR", help="keep converted examples in DIR so that later runs skip parsing and conversion of unchanged examples")
+parser.add_argument("--convert-cache-size", type=int, metavar="MB", help="trim the --convert-cache directory to MB megabytes after the run, least recently used first")
+parser.add_argument("--lazy-trials", action="store_true", help="parse and convert each example's trials one at a time as they run, bounding memory by one trial instead of the largest example (uses the corpus index, building it if needed)")
+parser.add_argument("--jobs", type=int, default=0, metavar="N", help="run examples in N worker processes, each compiling its own engines; the report is the same as a serial run's, in the same order, and the speedup is written to stderr")
+parser.add_argument("--isolate", action="store_true", help="run each example in a supervised worker process (max(1, --jobs) of them), which is killed and restarted if the example exceeds a limit or crashes; the example is then reported as TIMEOUT or CRASH and the run goes on; unlike a normal run, this runs the functions that are otherwise skipped (prob.dist.binomialQF, the hypergeometric and negative binomial functions), and a hanging one is stopped after --trial-timeout")
+parser.add_argument("--trial-timeout", type=float, default=10.0, metavar="SECONDS", help="with --isolate, the longest one trial may run (default 10)")
+parser.add_argument("--example-timeout", type=float, default=120.0, metavar="SECONDS", help="with --isolate, the longest one example may run, including compiling its engine (default 120)")
+parser.add_argument("--memory-limit", type=int, metavar="MB", help="with --isolate, limit the address space of each worker to MB megabytes")
+parser.add_argument("--engine-cache", metavar="DIR", help="keep the compiled Python of every engine in DIR so that later runs skip type checking and code generation")
+parser.add_argument("--engine-cache-size", type=int, default=1024, metavar="N", help="keep the N most recently used compiled engines in memory (default 1024)")
+parser.add_argument("--timings", metavar="FILE", help="write the number, function, trial count and seconds of every example to FILE, for shardCorpus.py --timings")
+parser.add_argument("--journal", metavar="FILE", help="record every finished example and its report in FILE as the run goes, so that an interrupted run can be resumed")
+parser.add_argument("--result-cache", metavar="DIR", help="keep the report of every example in DIR, keyed by the hash of its text, the engine's fingerprint and the runner version, and report unchanged examples from it instead of running them")
+parser.add_argument("--fingerprint", choices=("module", "package"), default="module", help="with --result-cache, whether a cached report depends on the Titus modules its engine uses (the default) or on the whole titus package")
+parser.add_argument("--resume", action="store_true", help="with --journal, report the examples that FILE says are finished from it and run only the rest; the report is the same as an uninterrupted run's")
+args = parser.parse_args()
+if args.lazy_trials and (args.decode_workers > 0 or args.convert_cache is not None):
+    parser.error("--lazy-trials cannot be combined with --decode-workers or --convert-cache")
+if args.lazy_trials and (args.jobs > 0 or args.isolate):
+    parser.error("--lazy-trials cannot be combined with --jobs or --isolate")
+if args.resume and args.journal is None:
+    parser.error("--resume needs the --journal of the interrupted run")
+if os.path.isfile(args.inputFile):
+    with open(args.inputFile, "rb") as rawFile:
+        binary = isBinaryCorpus(rawFile)
+    if binary and not args.binary:
+        parser.error("%s is a binary corpus; pass --binary to read it (only for files you built yourself)" % args.inputFile)
+    if args.binary and not binary:
+        parser.error("%s is not a binary corpus written by convertCorpus.py" % args.inputFile)
+if args.result_cache is not None and (args.binary or not os.path.isfile(args.inputFile)):
+    parser.error("--result-cache needs a JSON corpus file, whose index gives the examples' hashes")
+
+inputFile = args.inputFile
 skipFcnList = ("prob.dist.binomialQF", "prob.dist.hypergeometricPDF", "prob.dist.hypergeometricCDF", "prob.dist.hypergeometricQF", "prob.dist.negativeBinomialPDF", "prob.dist.negativeBinomialQF")
 patternFcnList = ()
 # Failures that I'm giving up on:
@@ -23,99 +366,424 @@ patternFcnList = ()
 #                               {"x": 100, "prob": 0.5, "size": 100} should be 5.7e42, is 0.02817
 # prob.dist.negativeBinomialQF has many errors (though not as many as the hypergeometric)
 
-for counter, example in enumerate(getExamples(open(inputFile))):
-    if any([pattern in example["function"] for pattern in patternFcnList]):
-        print("%4d    pat skipped %s" % (counter + 1, example["function"]))
-        continue         
+# With --isolate, hangs and crashes are contained by the supervisor, so the
+# functions above are run and reported like any other.
+
+convertCache = None
+if args.convert_cache is not None:
+    convertCache = ConvertCache(args.convert_cache, None if args.convert_cache_size is None else args.convert_cache_size * 1024 * 1024)
+
+# examples that share an engine (such as those of a deduplicated corpus) share
+# its compiled class, too, but each gets an instance of its own, so that no
+# cells, pools, random state or begin/end effects carry over between examples
+engineCache = EngineCache(args.engine_cache_size, args.engine_cache)
+
+timings = None if args.timings is None else open(args.timings, "w")
+
+def titusErrorCode(err):
+    return err.code
+
+def recordTiming(counter, function, numTrials, seconds):
+    if timings is not None:
+        timings.write("%d\t%s\t%d\t%.6f\n" % (counter + 1, function, numTrials, seconds))
+
+def finishExample(counter, function, numTrials, seconds, lines):
+    # called for each example once its report lines have been printed
+    recordTiming(counter, function, numTrials, seconds)
+    if journal is not None:
+        journal.record(counter, function, numTrials, seconds, lines)
+
+def executedExample(counter, example, seconds, lines, completed=True):
+    # finishExample for an example that was run, not reported from the
+    # result cache; its report is cached if it was not skipped and it ran to
+    # the end (not a TIMEOUT or CRASH)
+    global numExecuted
+    numExecuted += 1
+    if resultCache is not None and completed and isSkipped(example["function"]) is None:
+        resultCache.put(contentHashes[counter], counter, example["function"], len(example["trials"]), seconds, lines, fingerprint.engine(example["engine"]))
+    finishExample(counter, example["function"], len(example["trials"]), seconds, lines)
+
+def reportCached(before=None):
+    # prints the cached reports of the examples before number before (all of
+    # them if None), so that they come in corpus order with the others
+    global numReused
+    while cached and (before is None or cached[0]["number"] < before):
+        result = cached.popleft()
+        for line in result["lines"]:
+            print(line)
+        finishExample(result["number"], result["function"], result["trials"], result["seconds"], result["lines"])
+        numReused += 1
+
+def describeResult(result):
+    if "success" in result:
+        return json.dumps(result["success"])
+    else:
+        return "ERROR CODE " + str(result["fail"])
 
-    if example["function"] in skipFcnList:
-        print("%4d    fcn skipped %s" % (counter + 1, example["function"]))
-        continue
+def reportTrial(trial, result, functionWritten, maybeWriteFunction, write):
+    # writes what is wrong with one trial's result, if anything; returns the
+    # new functionWritten
+    trialWritten = False
+    if "error" in trial:
+        if trial["error"] != result.get("fail", None):
+            functionWritten = maybeWriteFunction(functionWritten)
+            if not trialWritten:
+                write("                            input:    " + json.dumps(trial["sample"]))
+                write("                            expected: ERROR CODE " + str(trial["error"]))
+                write("                            actual:   " + describeResult(result))
+                trialWritten = True
 
-    engine, = PFAEngine.fromJson(example["engine"])
+    elif trial.get("nondeterministic", None) in ("pseudorandom", "unstable"):
+        pass
+
+    else:
+        def maybeWriteTrial(trialWritten):
+            if not trialWritten:
+                write("                            input:    " + json.dumps(trial["sample"]))
+                write("                            expected: " + json.dumps(trial["result"]))
+                write("                            actual:   " + describeResult(result))
+            return True
+
+        if "success" in result:
+            left = trial["result"]
+            right = result["success"]
+
+            if trial.get("nondeterministic", None) == "unordered":
+                errorMessages = compareUnordered(left, right, 1e-4, 0.05, 1e80)
+            else:
+                errorMessages = compare(left, right, 1e-4, 0.05, 1e80)
+
+            for errorMessage in errorMessages:
+                functionWritten = maybeWriteFunction(functionWritten)
+                trialWritten = maybeWriteTrial(trialWritten)
+                write("                            " + errorMessage)
+        else:
+            functionWritten = maybeWriteFunction(functionWritten)
+            trialWritten = maybeWriteTrial(trialWritten)
+    return functionWritten
+
+def isSkipped(function):
+    # why examples of function are skipped in this run ("pat" or "fcn"), if
+    # they are
+    if any([pattern in function for pattern in patternFcnList]):
+        return "pat"
+    if function in skipFcnList and not args.isolate:
+        return "fcn"
+    return None
+
+def runExample(counter, example, write):
+    # runs one example, passing each line of its report to write
+    skipped = isSkipped(example["function"])
+    if skipped is not None:
+        write("%4d    %s skipped %s" % (counter + 1, skipped, example["function"]))
+        return
+
+    engine = engineCache.engine(example["engine"], example.get("engineRef"))
+    convertResult = compileOutputConverter(engine.outputType.jsonNode(set()), dobase64=True)
 
     functionWritten = False
     def maybeWriteFunction(functionWritten):
         if not functionWritten:
-            print("%4d    %-20s%s" % (counter + 1, example["function"], json.dumps(example["engine"])))
+            write("%4d    %-20s%s" % (counter + 1, example["function"], json.dumps(example["engine"])))
         return True
 
-    for trial in example["trials"]:
-        trialWritten = False
-        try:
-            result = {"success": convertOut(engine.action(trial["sample"]), engine.outputType.jsonNode(set()), dobase64=True)}
-        except PFARuntimeException as err:
-            result = {"fail": err.code}
-        except Exception:
+    action = engine.action
+    if trialProgress is not None:
+        action = watchedAction(action, trialProgress)
+
+    for trials in trialBatches(example["trials"]):
+        results, failure = runActions(action, [x["sample"] for x in trials], convertResult, PFARuntimeException, titusErrorCode, getattr(engine, "actionBatch", None))
+        for trial, result in zip(trials, results):
+            functionWritten = reportTrial(trial, result, functionWritten, maybeWriteFunction, write)
+
+        if failure is not None:
+            trial = trials[len(results)]
             # PFAEngine.fromJson(example["engine"], debug=True)
-            print("function: " + example["function"])
-            print("engine:   " + json.dumps(example["engine"]))
-            print("input:    " + repr(trial["sample"]))
+            write("function: " + example["function"])
+            write("engine:   " + json.dumps(example["engine"]))
+            write("input:    " + repr(trial["sample"]))
             if "error" in trial:
-                print("expected: ERROR CODE " + repr(trial["error"]))
+                write("expected: ERROR CODE " + repr(trial["error"]))
             elif "result" in trial:
-                print("expected: " + repr(trial["result"]))
-            print("")
-            raise
+                write("expected: " + repr(trial["result"]))
+            write("")
+            raise failure[1]
 
-        if "success" in result:
-            actual = json.dumps(result["success"])
-        else:
-            actual = "ERROR CODE " + str(result["fail"])
+    if not functionWritten:
+        write("%4d    %s" % (counter + 1, example["function"]))
 
-        if "error" in trial:
-            if trial["error"] != result.get("fail", None):
-                functionWritten = maybeWriteFunction(functionWritten)
-                if not trialWritten:
-                    print("                            input:    " + json.dumps(trial["sample"]))
-                    print("                            expected: ERROR CODE " + str(trial["error"]))
-                    print("                            actual:   " + actual)
-                    trialWritten = True
+def runPooled(counter, example):
+    # runExample in a --jobs worker: its report lines, the traceback if it
+    # failed, its wall-clock and CPU seconds and what it added to the engine
+    # cache's counts
+    start = time.time()
+    cpuStart = time.process_time()
+    before = engineCache.counts()
+    lines = []
+    try:
+        runExample(counter, example, lines.append)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return lines, error, time.time() - start, time.process_time() - cpuStart, [x - y for x, y in zip(engineCache.counts(), before)]
 
-        elif trial.get("nondeterministic", None) in ("pseudorandom", "unstable"):
-            pass
+# Isolated workers: each --isolate worker is a process that runs the examples
+# it is sent with runPooled and sends back the results.  Before each trial, it
+# records the time and the number of trials started in trialProgress, a small
+# array shared with the supervisor, which kills the worker if the trial or the
+# example has run too long, or notices that it died, reports the example as
+# TIMEOUT or CRASH and starts a new worker for the next one.
 
-        else:
-            def maybeWriteTrial(trialWritten):
-                if not trialWritten:
-                    print("                            input:    " + json.dumps(trial["sample"]))
-                    print("                            expected: " + json.dumps(trial["result"]))
-                    print("                            actual:   " + actual)
-                return True
-
-            def mapToFloat(value):
-                if value in ["inf", "-inf"]:
-                    return float(value)
-                elif value == "nan":
-                    return float("inf")
+trialProgress = None
+
+def watchedAction(action, progress):
+    def watched(sample):
+        progress[0] = time.time()
+        progress[1] += 1
+        return action(sample)
+    return watched
+
+def isolatedWorker(connection, progress, memoryLimit):
+    global trialProgress
+    trialProgress = progress
+    if memoryLimit is not None:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (memoryLimit, memoryLimit))
+    while True:
+        try:
+            counter, example = connection.recv()
+        except EOFError:
+            return
+        connection.send(runPooled(counter, example))
+
+class IsolatedWorker(object):
+    # trialTimeout and exampleTimeout are in seconds, memoryLimit in bytes
+    # (or None for no limit)
+
+    def __init__(self, context, trialTimeout, exampleTimeout, memoryLimit=None):
+        self.context = context
+        self.trialTimeout = trialTimeout
+        self.exampleTimeout = exampleTimeout
+        self.memoryLimit = memoryLimit
+        self.starts = 0
+        self.start()
+
+    def start(self):
+        self.progress = self.context.RawArray("d", 2)
+        self.connection, child = self.context.Pipe()
+        self.process = self.context.Process(target=isolatedWorker, args=(child, self.progress, self.memoryLimit))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.job = None
+        self.starts += 1
+
+    def restart(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+        self.start()
+
+    def send(self, job):
+        # job is [counter, example, outcome], with outcome filled in later
+        self.progress[0] = 0.0
+        self.progress[1] = 0.0
+        self.job = job
+        self.sent = time.time()
+        try:
+            self.connection.send((job[0], job[1]))
+        except BrokenPipeError:
+            pass   # the worker died; the supervisor finds its connection closed
+
+    def deadline(self):
+        deadline = self.sent + self.exampleTimeout
+        if self.progress[1] > 0:
+            deadline = min(deadline, self.progress[0] + self.trialTimeout)
+        return deadline
+
+# With --journal, finished examples are recorded as they are reported; with
+# --resume, those of an interrupted run are reported again from the journal
+# and skipped in the corpus.
+journal = None
+if args.journal is not None:
+    try:
+        journal = ProgressJournal(args.journal, inputFile, args.select, args.resume)
+    except ValueError as err:
+        parser.error(str(err))
+    if journal.records:
+        sys.stderr.write("resuming after %d finished examples in %s\n" % (len(journal.records), args.journal))
+    for record in journal.records:
+        for line in record["lines"]:
+            print(line)
+        recordTiming(record["number"], record["function"], record["trials"], record["seconds"])
+
+# With --result-cache, the examples that have a report for this runner,
+# their text and their engine's current fingerprint are reported from the
+# cache and skipped in the corpus, like the journal's; the rest are run and
+# their reports added.
+resultCache = None
+cached = deque()
+contentHashes = {}
+numExecuted = 0
+numReused = 0
+skip = set() if journal is None else set(journal.finished)
+if args.result_cache is not None:
+    fingerprint = EngineFingerprint(args.fingerprint)
+    resultCache = ResultCache(args.result_cache, runnerVersion())
+    header, entries = requireIndex(inputFile, "the result cache")
+    if args.select:
+        entries = selectEntries(entries, args.select)
+    for entry in entries:
+        contentHashes[entry.number] = entry.hash
+        # examples skipped in this run are never reported from the cache, as
+        # an --isolate run may have cached their results
+        if entry.number not in skip and isSkipped(entry.function) is None:
+            result = resultCache.get(entry.hash, entry.number, fingerprint.current)
+            if result is not None:
+                cached.append(result)
+                skip.add(entry.number)
+
+examples = getNumberedExamples(inputFile, args.select, args.decode_workers, args.read_ahead, convertCache, args.lazy_trials, skip, args.binary)
+
+if args.isolate:
+    runStart = time.time()
+    context = multiprocessing.get_context("fork")
+    memoryLimit = None if args.memory_limit is None else args.memory_limit * 1024 * 1024
+    workers = [IsolatedWorker(context, args.trial_timeout, args.example_timeout, memoryLimit) for i in range(max(args.jobs, 1))]
+    pending = deque()
+    waiting = deque()
+    numExamples = 0
+    numTimeouts = 0
+    numCrashes = 0
+    exhausted = False
+
+    def finish(worker, lines, seconds, counts=(0, 0, 0, 0.0, 0.0), completed=False):
+        worker.job[2] = (lines, seconds, counts, completed)
+        worker.job = None
+
+    try:
+        while True:
+            while not exhausted and len(pending) < max(args.read_ahead, len(workers)):
+                counter, example = next(examples, (None, None))
+                if example is None:
+                    exhausted = True
                 else:
-                    return value
+                    job = [counter, example, None]
+                    pending.append(job)
+                    waiting.append(job)
+            for worker in workers:
+                if worker.job is None and waiting:
+                    worker.send(waiting.popleft())
 
-            if "success" in result:
-                left = trial["result"]
-                right = result["success"]
+            while pending and pending[0][2] is not None:
+                counter, example, (lines, seconds, counts, completed) = pending.popleft()
+                reportCached(counter)
+                for line in lines:
+                    print(line)
+                executedExample(counter, example, seconds, lines, completed)
+                engineCache.add(counts)
+                numExamples += 1
+            if not pending:
+                if exhausted:
+                    break
+                continue
 
-                if trial.get("nondeterministic", None) == "unordered":
-                    if not isinstance(left, list) or not isinstance(right, list):
-                        raise Exception
+            busy = [worker for worker in workers if worker.job is not None]
+            timeout = max(0.0, min(worker.deadline() for worker in busy) - time.time())
+            ready = multiprocessing.connection.wait([worker.connection for worker in busy], timeout)
+            for worker in busy:
+                counter, example = worker.job[0], worker.job[1]
+                if worker.connection in ready:
                     try:
-                        left.sort()
-                        right.sort()
-                    except:
-                        if isinstance(left[0], dict) and isinstance(right[0], dict):
-                            try:
-                                left = sorted([sorted([[k, mapToFloat(v)] for k,v in d.items()]) for d in left])
-                                right = sorted([sorted([[k, mapToFloat(v)] for k,v in d.items()]) for d in right])
-                            except: pass
-                        pass
-
-                for errorMessage in compare(left, right, 1e-4, 0.05, 1e80):
-                    functionWritten = maybeWriteFunction(functionWritten)
-                    trialWritten = maybeWriteTrial(trialWritten)
-                    print("                            " + errorMessage)
-            else:
-                functionWritten = maybeWriteFunction(functionWritten)
-                trialWritten = maybeWriteTrial(trialWritten)
+                        lines, error, seconds, cpuSeconds, counts = worker.connection.recv()
+                    except (EOFError, ConnectionResetError):
+                        worker.process.join()
+                        numCrashes += 1
+                        finish(worker, ["%4d    CRASH       %s: worker exited with code %s in trial %d of %d" % (counter + 1, example["function"], worker.process.exitcode, worker.progress[1], len(example["trials"]))], time.time() - worker.sent)
+                        worker.restart()
+                        continue
+                    if error is not None:
+                        # runExample raised; its last line names the exception
+                        sys.stderr.write(error)
+                        numCrashes += 1
+                        lines.append("%4d    CRASH       %s: %s" % (counter + 1, example["function"], error.strip().split("\n")[-1]))
+                        finish(worker, lines, seconds, counts)
+                        worker.restart()
+                    else:
+                        finish(worker, lines, seconds, counts, True)
+                elif time.time() >= worker.deadline():
+                    numTrials = worker.progress[1]
+                    if numTrials > 0 and worker.progress[0] + worker.trialTimeout <= worker.sent + worker.exampleTimeout:
+                        limit = "trial %d of %d ran longer than %g s" % (numTrials, len(example["trials"]), worker.trialTimeout)
+                    else:
+                        limit = "example ran longer than %g s" % worker.exampleTimeout
+                    numTimeouts += 1
+                    finish(worker, ["%4d    TIMEOUT     %s: %s" % (counter + 1, example["function"], limit)], time.time() - worker.sent)
+                    worker.restart()
+    finally:
+        for worker in workers:
+            worker.process.kill()
+            worker.process.join()
+    sys.stderr.write("ran %d examples in %.1f s in %d isolated workers: %d timed out, %d crashed, %d workers restarted\n" % (numExamples, time.time() - runStart, len(workers), numTimeouts, numCrashes, sum(worker.starts - 1 for worker in workers)))
 
-    if not functionWritten:
-        print("%4d    %s" % (counter + 1, example["function"]))
+elif args.jobs > 0:
+    # Examples are decoded here, as in a serial run, and run in a pool of
+    # args.jobs processes, each with its own engine cache; reports are
+    # printed in corpus order as they come back, with at most args.read_ahead
+    # examples in flight.
+    runStart = time.time()
+    exampleCpuSeconds = 0.0
+    numExamples = 0
+    pool = multiprocessing.get_context("fork").Pool(args.jobs)
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < args.read_ahead:
+                counter, example = next(examples, (None, None))
+                if example is None:
+                    break
+                pending.append((counter, example, pool.apply_async(runPooled, (counter, example))))
+            if not pending:
+                break
+            counter, example, result = pending.popleft()
+            lines, error, seconds, cpuSeconds, counts = result.get()
+            reportCached(counter)
+            for line in lines:
+                print(line)
+            if error is not None:
+                sys.stderr.write(error)
+                sys.exit(1)
+            executedExample(counter, example, seconds, lines)
+            exampleCpuSeconds += cpuSeconds
+            numExamples += 1
+            engineCache.add(counts)
+    finally:
+        pool.terminate()
+        pool.join()
+    wallSeconds = time.time() - runStart
+    # the examples' CPU time is about what a serial run would take
+    sys.stderr.write("ran %d examples in %.1f s with %d jobs on %d cores: %.1f s of example CPU time, %.2fx speedup\n" % (numExamples, wallSeconds, args.jobs, multiprocessing.cpu_count(), exampleCpuSeconds, exampleCpuSeconds / max(wallSeconds, 1e-9)))
+
+else:
+    for counter, example in examples:
+        exampleStart = time.time()
+        lines = []
+        def write(line):
+            print(line)
+            lines.append(line)
+        reportCached(counter)
+        runExample(counter, example, write)
+        executedExample(counter, example, time.time() - exampleStart, lines)
+
+reportCached()
+if resultCache is not None:
+    sys.stderr.write("result cache: executed %d examples, reused %d (fingerprints by %s)\n" % (numExecuted, numReused, args.fingerprint))
+
+if timings is not None:
+    timings.close()
+if journal is not None:
+    journal.close()
+
+numEngines = engineCache.hits + engineCache.diskHits + engineCache.misses
+if args.engine_cache is not None and numEngines > 0:
+    sys.stderr.write("engine cache: %d of %d engines from memory and %d from disk (%.1f%% hit rate); compiled %d in %.1f s, saving about %.1f s of compiling\n" % (engineCache.hits, numEngines, engineCache.diskHits, 100.0 * (engineCache.hits + engineCache.diskHits) / numEngines, engineCache.misses, engineCache.compileSeconds, engineCache.savedSeconds))
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+
+from runTest import loadTimings, shardCorpus
+
+# Usage: python shardCorpus.py pfa-tests.json N [--timings FILE ...] [--output-dir DIR]
+#
+# Splits a corpus into N shards of about equal estimated running time, plus a
+# manifest (shards.json).  Each shard is a corpus that the runners read
+# directly and that keeps the original example numbers; mergeReports.py
+# combines the reports on the shards into the report of a single run.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split a conformance corpus into shards balanced by estimated running time.")
+    parser.add_argument("inputFile")
+    parser.add_argument("numShards", type=int)
+    parser.add_argument("--timings", action="append", default=[], metavar="FILE", help="per-example timings from runTestTitus.py --timings; may be repeated")
+    parser.add_argument("--output-dir", default=".", metavar="DIR")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    manifest = shardCorpus(args.inputFile, args.numShards, args.output_dir, loadTimings(args.timings))
+    for shard in manifest["shards"]:
+        print("%-40s %6d examples %8d trials %10.1f s estimated" % (shard["file"], shard["examples"], shard["trials"], shard["estimatedSeconds"]))